@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Benchmark EmPreverb in-process (process_sentence) and end-to-end
+(python -m emPreverb) on the test inputs, on scaled copies of them and on
+adversarial inputs, and save the results as JSON.
+Results of two runs can be compared with --compare.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from glob import glob
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from emPreverb import EmPreverb, __version__  # noqa: E402
+from emPreverb.emPreverb import SOURCE_FIELDS, TARGET_FIELDS  # noqa: E402
+from emPreverb.tsv import (read_header, read_sentences,  # noqa: E402
+                           split_layout)
+
+PERCENTILES = (50, 90, 99, 100)
+REGRESSION_THRESHOLD = 0.1  # relative slowdown reported as regression
+
+
+def read_corpus(path):
+    """:return: header line and list of sentences (lists of lines)"""
+    with open(path, encoding='utf-8') as fh:
+        header = next(fh)
+        sentences = []
+        sen = []
+        for line in fh:
+            if line == '\n':
+                if sen:
+                    sentences.append(sen)
+                sen = []
+            else:
+                sen.append(line)
+        if sen:
+            sentences.append(sen)
+    return header, sentences
+
+
+def write_corpus(path, header, sentences):
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write(header)
+        for sen in sentences:
+            fh.writelines(sen)
+            fh.write('\n')
+
+
+def make_corpora(inputs, scales, workdir):
+    """
+    Create the benchmark corpora from *inputs*.
+    :return: dict of corpus name -> file path
+    """
+    inputs = [os.path.abspath(path) for path in inputs]
+    corpora = {}
+    for path in inputs:
+        name = os.path.splitext(os.path.basename(path))[0]
+        header, sentences = read_corpus(path)
+        for scale in scales:
+            if scale == 1:
+                corpora[name] = path
+                continue
+            scaled = os.path.join(workdir, '{0}_x{1}.in'.format(name, scale))
+            write_corpus(scaled, header, sentences * scale)
+            corpora['{0}_x{1}'.format(name, scale)] = scaled
+
+    # adversarial inputs from the first input
+    header, sentences = read_corpus(inputs[0])
+    anas_index = header.rstrip('\n').split('\t').index('anas')
+
+    # all tokens in a single sentence
+    path = os.path.join(workdir, 'long_sentence.in')
+    write_corpus(path, header, [[line for sen in sentences for line in sen]])
+    corpora['long_sentence'] = path
+
+    # only the sentences with preverbs, as many as in the input
+    dense = [sen for sen in sentences
+             if any('\t[/Prev]' in line for line in sen)]
+    path = os.path.join(workdir, 'preverb_dense.in')
+    write_corpus(path, header,
+                 (dense * (len(sentences) // len(dense) + 1))[:len(sentences)])
+    corpora['preverb_dense'] = path
+
+    # anas columns repeated 20 times (the selected analysis is unchanged)
+    def huge_anas(line):
+        cols = line.rstrip('\n').split('\t')
+        anas = json.loads(cols[anas_index])
+        cols[anas_index] = json.dumps(anas * 20, ensure_ascii=False)
+        return '\t'.join(cols) + '\n'
+
+    path = os.path.join(workdir, 'huge_anas.in')
+    write_corpus(path, header, [[huge_anas(line) for line in sen]
+                                for sen in sentences])
+    corpora['huge_anas'] = path
+    return corpora
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {'p{0}'.format(p):
+            values[min(len(values) - 1, len(values) * p // 100)] * 1000
+            for p in PERCENTILES}
+
+
+def bench_in_process(path, repeat):
+    """Time EmPreverb.process_sentence() on each sentence of *path*."""
+    with open(path, encoding='utf-8') as fh:
+        fields, _ = read_header(fh, SOURCE_FIELDS, TARGET_FIELDS)
+        maxsplit, field_names = split_layout(
+            fields, SOURCE_FIELDS | {'compound'}, TARGET_FIELDS)
+        sentences = [sen for sen, _ in read_sentences(fh, maxsplit=maxsplit)]
+    tokens = sum(len(sen) for sen in sentences)
+
+    em_preverb = EmPreverb(source_fields=SOURCE_FIELDS,
+                           target_fields=TARGET_FIELDS)
+    field_values = em_preverb.prepare_fields(field_names)
+
+    def fresh():
+        # process_sentence() extends the rows in place
+        return [[list(tok) for tok in sen] for sen in sentences]
+
+    totals = []
+    latencies = []
+    for _ in range(repeat):
+        batch = fresh()
+        clock = time.perf_counter
+        total = 0.0
+        for sen in batch:
+            start = clock()
+            em_preverb.process_sentence(sen, field_values)
+            latency = clock() - start
+            latencies.append(latency)
+            total += latency
+        totals.append(total)
+
+    batch = fresh()
+    tracemalloc.start()
+    for sen in batch:
+        em_preverb.process_sentence(sen, field_values)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'sentences': len(sentences),
+            'tokens': tokens,
+            'seconds': median(totals),
+            'tokens_per_sec': tokens / median(totals),
+            'latency_ms': percentiles(latencies),
+            'peak_memory_bytes': peak}
+
+
+def bench_cli(path, repeat, cli_args):
+    """Time python -m emPreverb on *path* and measure its peak RSS."""
+    with open(path, encoding='utf-8') as fh:
+        tokens = sum(1 for line in fh if line != '\n') - 1
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+    rss = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, '-m', 'emPreverb',
+                                 *cli_args, '-i', path, '-o', os.devnull],
+                                env=env, cwd=tempfile.gettempdir())
+        _, status, rusage = os.wait4(proc.pid, 0)
+        times.append(time.perf_counter() - start)
+        if status != 0:
+            raise RuntimeError('emPreverb failed on {0}'.format(path))
+        # ru_maxrss is in kilobytes on Linux
+        rss.append(rusage.ru_maxrss * 1024)
+    return {'tokens': tokens,
+            'seconds': median(times),
+            'tokens_per_sec': tokens / median(times),
+            'peak_rss_bytes': max(rss)}
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    """
+    Print the change of tokens/sec between two result files.
+    :return: the number of regressions
+    """
+    regressions = 0
+    for corpus, results in new['results'].items():
+        for mode, result in results.items():
+            before = old['results'].get(corpus, {}).get(mode)
+            if before is None:
+                continue
+            ratio = result['tokens_per_sec'] / before['tokens_per_sec']
+            regression = ratio < 1 - threshold
+            regressions += regression
+            print('{0:30} {1:10} {2:12.0f} -> {3:12.0f} tokens/s '
+                  '({4:+.1%}){5}'.format(
+                      corpus, mode, before['tokens_per_sec'],
+                      result['tokens_per_sec'], ratio - 1,
+                      '  REGRESSION' if regression else ''),
+                  file=sys.stderr)
+    return regressions
+
+
+def main():
+    argparser = ArgumentParser(description=__doc__)
+    argparser.add_argument('-i', '--inputs', nargs='+',
+                           default=sorted(glob(os.path.join(
+                               ROOT, 'tests', 'inputs', '*.in'))),
+                           help='Input files (default: tests/inputs/*.in)')
+    argparser.add_argument('-s', '--scales', default='1,10,100',
+                           help='Comma separated scale factors of the '
+                                'inputs (default: %(default)s)')
+    argparser.add_argument('-r', '--repeat', type=int, default=3,
+                           help='Runs per measurement, the median is '
+                                'reported (default: %(default)s)')
+    argparser.add_argument('--cli-args', default='',
+                           help='Extra arguments of python -m emPreverb, '
+                                'e.g. "-j 4"')
+    argparser.add_argument('--no-cli', dest='cli', action='store_false',
+                           help='Skip the end-to-end CLI benchmarks')
+    argparser.add_argument('-o', '--output',
+                           help='Save the results to this JSON file')
+    argparser.add_argument('--compare', metavar='OLD_JSON',
+                           help='Compare the results with a previous '
+                                'result file')
+    opts = argparser.parse_args()
+
+    scales = [int(scale) for scale in opts.scales.split(',')]
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for corpus, path in make_corpora(opts.inputs, scales,
+                                         workdir).items():
+            results[corpus] = {'in_process': bench_in_process(path,
+                                                              opts.repeat)}
+            if opts.cli:
+                results[corpus]['cli'] = bench_cli(path, opts.repeat,
+                                                   opts.cli_args.split())
+            for mode, result in results[corpus].items():
+                print('{0:30} {1:10} {2:12.0f} tokens/s'.format(
+                    corpus, mode, result['tokens_per_sec']),
+                    file=sys.stderr, flush=True)
+
+    report = {'version': __version__,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'repeat': opts.repeat,
+              'results': results}
+    if opts.output:
+        with open(opts.output, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if opts.compare:
+        with open(opts.compare, encoding='utf-8') as fh:
+            sys.exit(1 if compare(json.load(fh), report) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,54 @@
 
 '''Run build_pipeline'''
 
-from xtsv import build_pipeline, parser_skeleton, jnius_config
+import io
+import sys
+from argparse import ArgumentParser, ArgumentTypeError, FileType
+
+from .compressed import FORMATS, compression_stats, open_input, open_output
+from .emPreverb import EmPreverb
+from .shards import check_shard
+from .tsv import process_stream
+
+
+def shard_id(value):
+    """Check the shard id given with --shard."""
+    try:
+        return check_shard(value)
+    except ValueError as e:
+        raise ArgumentTypeError(str(e))
+
+
+def parser_skeleton(*args, **kwargs):
+    '''The argument parser of xtsv, without importing xtsv'''
+    parser = ArgumentParser(*args, **kwargs)
+    input_group = parser.add_mutually_exclusive_group()
+    input_group.add_argument('-i', '--input', dest='input_stream', type=FileType(), default=sys.stdin,
+                             help='Use input file instead of --text or STDIN '
+                                  '(only allowed when at least one task is specified!)', metavar='FILE')
+    input_group.add_argument('-t', '--text', dest='input_text',  type=str, default=None,
+                             help='Use input text instead of file or STDIN '
+                                  '(only allowed when at least one task is specified!)', metavar='TEXT')
+    parser.add_argument('-o', '--output', dest='output_stream',  type=FileType('w'), default=sys.stdout,
+                        help='Use output file instead of STDOUT (only allowed when at least one task is specified!)',
+                        metavar='FILE')
+
+    add_bool_arg(parser, 'verbose', 'Show warnings')
+    add_bool_arg(parser, 'conllu-comments', 'Enable CoNLL-U style comments (lines starting with "# ")')
+    add_bool_arg(parser, 'output-header', 'Disable header for output')
+
+    parser.add_argument(dest='task', nargs='?', default=())
+
+    return parser
+
+
+def add_bool_arg(parser, name, help_text, default=False):
+    '''Add --name and --no-name options as in xtsv'''
+    group = parser.add_mutually_exclusive_group(required=False)
+    group.add_argument('--no-' + name, dest=name.replace('-', '_'), help='{0} (negative variant)'.format(help_text),
+                       action='store_false')
+    group.add_argument('--' + name, dest=name.replace('-', '_'), help=help_text, action='store_true')
+    parser.set_defaults(**{name.replace('-', '_'): default})
 
 
 def main():
@@ -11,16 +58,73 @@ def main():
     argparser = parser_skeleton(
         description='EmPreverb - connect preverb tokens to the verb or ' +
                     'verb-derivative token from which they were separated')
+    argparser.add_argument('-j', '--jobs', type=int, default=1,
+                           help='Number of worker processes (default: 1)',
+                           metavar='N')
+    argparser.add_argument('--xtsv', action='store_true',
+                           help='Run through the xtsv pipeline instead of '
+                                'the built-in TSV reader')
+    argparser.add_argument('--engine', choices=['reference', 'vectorised'],
+                           default='reference',
+                           help='Rule evaluation engine: reference or '
+                                'vectorised (requires numpy) '
+                                '(default: reference)')
+    argparser.add_argument('--cache', default=None,
+                           help='Reuse the results of unchanged sentences '
+                                'stored in this SQLite file', metavar='FILE')
+    argparser.add_argument('--cache-size', type=int, default=1024,
+                           help='Maximum size of the cache in megabytes '
+                                '(default: 1024)', metavar='MB')
+    argparser.add_argument('--delta', choices=['text', 'binary'],
+                           default=None,
+                           help='Write only the changed fields of the changed '
+                                'tokens in text or binary format (apply them '
+                                'with python -m emPreverb.delta)')
+    argparser.add_argument('--window', type=int, default=None,
+                           help='Process the sentences TOKENS tokens at a '
+                                'time with a bounded buffer, for very long '
+                                'sentences', metavar='TOKENS')
+    argparser.add_argument('--shard', type=shard_id, default=None,
+                           help='Write deterministic shard-local previd '
+                                'values (SHARD.SENTENCE.K) with this shard '
+                                'id (concatenate the outputs with python -m '
+                                'emPreverb.shards)', metavar='SHARD')
+    argparser.add_argument('--compress', choices=FORMATS, default=None,
+                           help='Compress the output in this format '
+                                '(default: by the extension of the output '
+                                'file name; compressed input is detected)')
+    argparser.add_argument('--stats', action='store_true',
+                           help='Print rule (and cache) statistics to STDERR')
+    argparser.add_argument('--stats-json', type=FileType('w'), default=None,
+                           help='Save rule statistics as JSON to FILE',
+                           metavar='FILE')
     opts = argparser.parse_args()
-
-    jnius_config.classpath_show_warning = opts.verbose
+    collect_stats = opts.stats or opts.stats_json is not None
+    if opts.xtsv and collect_stats:
+        argparser.error('rule statistics are not available with --xtsv')
+    if opts.xtsv and opts.engine != 'reference':
+        argparser.error('only the reference engine is available with --xtsv')
+    if opts.cache is not None and (opts.xtsv or opts.jobs > 1):
+        argparser.error('--cache is not available with --xtsv or --jobs')
+    if opts.delta is not None and (opts.xtsv or opts.jobs > 1):
+        argparser.error('--delta is not available with --xtsv or --jobs')
+    if opts.window is not None and (opts.xtsv or opts.jobs > 1 or
+                                    opts.cache is not None or
+                                    opts.delta is not None):
+        argparser.error('--window is not available with --xtsv, --jobs, '
+                        '--cache or --delta')
+    if opts.shard is not None and opts.xtsv:
+        argparser.error('--shard is not available with --xtsv')
+    if opts.window is not None and opts.window < 1:
+        argparser.error('--window must be at least 1')
 
     # Set input and output iterators from command line args
     if opts.input_text is not None:
         input_data = opts.input_text
     else:
-        input_data = opts.input_stream
-    output_iterator = opts.output_stream
+        input_data = open_input(opts.input_stream)
+    output_stream = open_output(opts.output_stream, opts.compress)
+    output_iterator = output_stream
 
     used_tools = ['preverb']
     presets = []
@@ -41,15 +145,75 @@ def main():
         )
     ]
 
-    output_iterator.writelines(
-        build_pipeline(
-            input_data,
-            used_tools,
-            tools,
-            presets,
-            opts.conllu_comments
+    if opts.xtsv:
+        from xtsv import build_pipeline, jnius_config
+
+        jnius_config.classpath_show_warning = opts.verbose
+
+        output_iterator.writelines(
+            build_pipeline(
+                input_data,
+                used_tools,
+                tools,
+                presets,
+                opts.conllu_comments
+            )
         )
-    )
+        if output_stream is not opts.output_stream:
+            output_stream.close()
+        return
+
+    if isinstance(input_data, str):
+        # not str.splitlines(), which also splits at U+2028 etc.
+        input_data = io.StringIO(input_data)
+
+    if opts.engine == 'vectorised':
+        from .vectorised import VectorisedEmPreverb as engine
+    else:
+        engine = EmPreverb
+
+    if opts.jobs > 1:
+        from .parallel import process_parallel
+
+        stats = process_parallel(input_data, output_iterator, opts.jobs,
+                                 conll_comments=opts.conllu_comments,
+                                 stats=collect_stats, engine=engine,
+                                 shard=opts.shard, **em_preverb[4])
+    else:
+        em_preverb_instance = engine(*em_preverb[3], stats=collect_stats,
+                                     **em_preverb[4])
+        delta = None
+        if opts.delta == 'text':
+            from .delta import TextDeltaWriter as delta
+        elif opts.delta == 'binary':
+            from .delta import BinaryDeltaWriter as delta
+
+            output_iterator = output_iterator.buffer
+        cache = None
+        if opts.cache is not None:
+            from .cache import SentenceCache
+
+            cache = SentenceCache(opts.cache, opts.cache_size * 1024 ** 2)
+        try:
+            process_stream(em_preverb_instance, input_data, output_iterator,
+                           opts.conllu_comments, cache, delta, opts.window,
+                           opts.shard)
+        finally:
+            if cache is not None:
+                cache.close()
+        stats = em_preverb_instance.stats
+    if output_stream is not opts.output_stream:
+        # finish the compressed output
+        output_stream.close()
+
+    if opts.stats:
+        sys.stderr.write(stats.summary())
+        if opts.cache is not None:
+            sys.stderr.write(cache.summary())
+        for stage in compression_stats(input_data, output_stream):
+            sys.stderr.write(stage.summary())
+    if opts.stats_json is not None:
+        opts.stats_json.write(stats.to_json(indent=2) + '\n')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Asyncio interface of EmPreverb for annotation services.
+
+The sentences of a document are read from an (async) iterable and
+processed in batches in an executor, so the event loop is not blocked.
+At most `concurrency` batches are processed at a time, and no more
+sentences are read until the oldest batch is returned, so memory is
+bounded even if the consumer is slow.
+Each batch is numbered from 1 by its worker, and `previd` values are
+shifted by the number of ids used by the preceding batches of the
+document, as in emPreverb.parallel, so the output of a document is the
+same as that of `python -m emPreverb` for it.
+
+    aio_preverb = AsyncEmPreverb(['form', 'wsafter', 'anas', 'lemma',
+                                  'xpostag'])
+    async for sen in aio_preverb.process_sentences(sentences):
+        ...
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from .emPreverb import SOURCE_FIELDS, TARGET_FIELDS, EmPreverb
+from .tsv import make_field_names
+
+
+BATCH_SIZE = 64 # sentences processed at a time
+BATCH_TOKENS = 2000 # tokens processed at a time (for even batch times)
+
+# the EmPreverb instance and Layout for each config in this process,
+# shared by the threads (each batch is a new Document)
+_engines = {}
+_lock = Lock()
+
+
+class AsyncEmPreverb:
+    """Run EmPreverb on documents in an executor."""
+
+    def __init__(self, fields, source_fields=SOURCE_FIELDS,
+                 target_fields=TARGET_FIELDS, engine=EmPreverb,
+                 concurrency=1, executor=None, batch_size=BATCH_SIZE,
+                 batch_tokens=BATCH_TOKENS):
+        """
+        :param fields: the field names of the input rows
+        :param engine: the EmPreverb class to use
+        :param concurrency: the number of batches processed at a time
+        :param executor: a concurrent.futures executor to use (default:
+                         a thread pool of *concurrency* threads)
+        :param batch_size: the maximum number of sentences in a batch
+        :param batch_tokens: the maximum number of tokens in a batch
+                             (a longer sentence is a batch by itself)
+        """
+        names = list(fields) + list(target_fields)
+        # everything needed to set up an instance, sent with each batch
+        self.config = (engine, frozenset(source_fields), tuple(target_fields),
+                       tuple(names))
+        self.previd_index = names.index('previd')
+        self.concurrency = concurrency
+        self.own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(concurrency)
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+
+    async def process_sentences(self, sentences):
+        """
+        Process the sentences (token row lists) of a document given as
+        an async or ordinary iterable.
+        If the iteration is stopped or cancelled, the batches not yet
+        started are cancelled.
+        :return: async iterator of the processed sentences
+        """
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        prev_id = 0
+        try:
+            async for batch in self._batches(sentences):
+                pending.append(loop.run_in_executor(
+                    self.executor, _process_batch, self.config, batch))
+                if len(pending) >= self.concurrency:
+                    processed, used_ids = await pending.popleft()
+                    for sen in self._renumber(processed, prev_id):
+                        yield sen
+                    prev_id += used_ids
+            while pending:
+                processed, used_ids = await pending.popleft()
+                for sen in self._renumber(processed, prev_id):
+                    yield sen
+                prev_id += used_ids
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def process_document(self, sentences):
+        """
+        Process a document (see process_sentences()).
+        :return: the list of processed sentences
+        """
+        return [sen async for sen in self.process_sentences(sentences)]
+
+    def close(self):
+        """Shut down the executor (if it was created here)."""
+        if self.own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def _batches(self, sentences):
+        batch = []
+        tokens = 0
+        async for sen in _aiter(sentences):
+            if batch and (len(batch) == self.batch_size or
+                          tokens + len(sen) > self.batch_tokens):
+                yield batch
+                batch = []
+                tokens = 0
+            batch.append(sen)
+            tokens += len(sen)
+        if batch:
+            yield batch
+
+    def _renumber(self, processed, prev_id):
+        if prev_id:
+            previd_index = self.previd_index
+            for sen in processed:
+                for tok in sen:
+                    if tok[previd_index]:
+                        tok[previd_index] = str(int(tok[previd_index]) +
+                                                prev_id)
+        return processed
+
+
+async def _aiter(iterable):
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def _process_batch(config, batch):
+    """
+    Process a batch of sentences as a new document with the EmPreverb
+    instance of this process set up for *config*.
+    :return: the processed sentences and the number of used ids
+    """
+    engine = _engines.get(config)
+    if engine is None:
+        with _lock:
+            engine_class, source_fields, target_fields, names = config
+            em_preverb = engine_class(source_fields=set(source_fields),
+                                      target_fields=list(target_fields))
+            engine = _engines.setdefault(
+                config, (em_preverb,
+                         em_preverb.prepare_fields(make_field_names(names))))
+    em_preverb, layout = engine
+    document = em_preverb.new_document(layout)
+    processed = list(em_preverb.process_sentences(batch, layout, document))
+    return processed, document.prev_id
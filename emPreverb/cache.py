@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Persistent cache of sentence results for re-annotating corpora in which
+most sentences are unchanged between runs (or are repeated).
+
+The output of EmPreverb for a sentence depends only on the source fields
+of its tokens, apart from the `previd` numbering. The cache is keyed by
+a hash of these fields, and it stores the changed fields of the changed
+tokens with `previd` values relative to the sentence, which are
+renumbered when the result is reused, and the rule statistics of the
+sentence, which are added to those of EmPreverb.
+The results are stored in an SQLite database with an in-memory LRU
+cache in front of it. The least recently used results are evicted from
+the database when its size exceeds a limit.
+"""
+
+import inspect
+import json
+import sqlite3
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+from time import perf_counter
+
+from . import rules
+from .version import __version__
+
+
+KEY_FIELDS = ('form', 'anas', 'lemma', 'xpostag', 'compound')
+EDITED_FIELDS = ('prev', 'previd', 'prevpos', 'lemma', 'xpostag', 'compound')
+DEFAULT_MAX_BYTES = 1024 ** 3
+DEFAULT_MEMORY_SIZE = 2 ** 16 # sentences
+FLUSH_EVERY = 10000 # database writes
+
+
+class SentenceCache:
+    """SQLite database of sentence results with an LRU cache in front."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES,
+                 memory_size=DEFAULT_MEMORY_SIZE):
+        self.max_bytes = max_bytes
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS sentences '
+                        '(key BLOB PRIMARY KEY, value TEXT, '
+                        'size INTEGER, used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS sentences_used '
+                        'ON sentences (used)')
+        self.size, self.clock = self.db.execute(
+            'SELECT TOTAL(size), MAX(used) FROM sentences').fetchone()
+        self.size = int(self.size)
+        self.clock = self.clock or 0
+        self.used = {} # key -> clock of the hits not yet written
+        self.pending = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, usable=None):
+        """
+        Return the result stored for *key* or None.
+        :param usable: a function of the result which tells whether it
+                       can be used (if not, None is returned)
+        """
+        self.clock += 1
+        value = self.memory.get(key)
+        in_memory = value is not None
+        if not in_memory:
+            row = self.db.execute('SELECT value FROM sentences WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+        if value is not None and usable is not None and not usable(value):
+            self.discard(key)
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        if in_memory:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+        else:
+            self._remember(key, value)
+            self.disk_hits += 1
+        self.used[key] = self.clock
+        self._written()
+        return value
+
+    def put(self, key, value):
+        """Store the result *value* (a JSON-serialisable list) for *key*."""
+        self.clock += 1
+        text = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        size = len(key) + len(text.encode('utf-8'))
+        self.db.execute('INSERT OR REPLACE INTO sentences VALUES (?, ?, ?, ?)',
+                        (key, text, size, self.clock))
+        self.size += size
+        self._remember(key, value)
+        self._written()
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def discard(self, key):
+        """Remove the result stored for *key*."""
+        self.memory.pop(key, None)
+        row = self.db.execute('SELECT size FROM sentences WHERE key = ?',
+                              (key,)).fetchone()
+        if row is not None:
+            self.db.execute('DELETE FROM sentences WHERE key = ?', (key,))
+            self.size -= row[0]
+
+    def evict(self):
+        """Remove the least recently used results down to 90% of the limit."""
+        self.flush()
+        while self.size > 0.9 * self.max_bytes:
+            oldest = self.db.execute('SELECT key, size FROM sentences '
+                                     'ORDER BY used LIMIT 1000').fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if self.size <= 0.9 * self.max_bytes:
+                    break
+                self.db.execute('DELETE FROM sentences WHERE key = ?', (key,))
+                self.memory.pop(key, None)
+                self.size -= size
+                self.evictions += 1
+        self.db.commit()
+
+    def flush(self):
+        """Write the recency of the hits and commit."""
+        self.db.executemany('UPDATE sentences SET used = ? WHERE key = ?',
+                            ((used, key) for key, used in self.used.items()))
+        self.used = {}
+        self.pending = 0
+        self.db.commit()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _written(self):
+        self.pending += 1
+        if self.pending >= FLUSH_EVERY:
+            self.flush()
+
+    def hit_rate(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def as_dict(self):
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+            'evictions': self.evictions,
+            'size_bytes': self.size,
+        }
+
+    def summary(self):
+        """Return a human-readable summary."""
+        return ('sentence cache: {0:.1%} hit rate ({1} memory hits, {2} disk '
+                'hits, {3} misses), {4} evictions, {5} bytes\n'.format(
+                    self.hit_rate(), self.memory_hits, self.disk_hits,
+                    self.misses, self.evictions, self.size))
+
+
+@lru_cache(maxsize=None)
+def engine_digest(engine):
+    """
+    Return a digest of the source of the modules of the EmPreverb class
+    *engine* and its bases (the tags, clean_up() etc.) and of the rules.
+    """
+    digest = blake2b(digest_size=16)
+    modules = [sys.modules[cls.__module__] for cls in engine.__mro__
+               if cls is not object] + [rules]
+    for module in dict.fromkeys(modules):
+        digest.update(inspect.getsource(module).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _rule_counts(stats):
+    """Return the counts of *stats* which the rules change."""
+    return stats.case_tokens, stats.orphans, dict(stats.hits)
+
+
+def process_cached(em_preverb, sentences, field_names, cache):
+    """
+    Process an iterable of sentences with *em_preverb*, reusing the
+    results stored in *cache* and storing the new ones.
+    If *em_preverb* collects statistics, the reused results are counted
+    in them as they were when the result was stored.
+    :param field_names: the field names as given to prepare_fields()
+    :return: iterator of the processed sentences (see process_sentence)
+    """
+    key_indices = [field_names[name] for name in KEY_FIELDS
+                   if name in field_names]
+    edited_indices = [field_names.get(name) for name in EDITED_FIELDS]
+    previd_index = field_names['previd']
+    # results depend on the code of the engine, the rules (as compiled
+    # for the layout) and the presence of `compound`
+    salt = '{0}\t{1}\t{2}\n{3}'.format(
+        __version__, engine_digest(type(em_preverb)), len(key_indices),
+        em_preverb.document.layout.apply_rules.source).encode('utf-8')
+    empty_targets = [''] * len(em_preverb.target_fields)
+    stats = em_preverb.stats
+    # the results stored without statistics are processed again
+    usable = None if stats is None else lambda value: value[2] is not None
+
+    for sen in sentences:
+        digest = blake2b(salt, digest_size=16)
+        for tok in sen:
+            digest.update('\t'.join([tok[i] for i in key_indices])
+                          .encode('utf-8'))
+            digest.update(b'\n')
+        key = digest.digest()
+
+        value = cache.get(key, usable)
+        base = em_preverb.prev_id
+        if value is not None:
+            start = perf_counter()
+            used_ids, edits, counts = value
+            for tok in sen:
+                tok.extend(empty_targets)
+            for i, *values in edits:
+                tok = sen[i]
+                for index, field_value in zip(edited_indices, values):
+                    if index is not None:
+                        tok[index] = field_value
+                if tok[previd_index]:
+                    tok[previd_index] = str(int(tok[previd_index]) + base)
+            em_preverb.prev_id += used_ids
+            if stats is not None:
+                case_tokens, orphans, hits = counts
+                stats.case_tokens += case_tokens
+                stats.orphans += orphans
+                for rule, rule_hits in hits.items():
+                    stats.hits[rule] += rule_hits
+                stats.add_sentence(len(sen), perf_counter() - start)
+            yield sen
+            continue
+
+        originals = [tuple(tok) for tok in sen]
+        if stats is not None:
+            before = _rule_counts(stats)
+        processed = em_preverb.process_sentence(sen, None)
+        edits = []
+        for i, (tok, original) in enumerate(zip(processed, originals)):
+            if tok[len(original):] != empty_targets or \
+                    tok[:len(original)] != list(original):
+                values = [tok[index] if index is not None else None
+                          for index in edited_indices]
+                if values[1]:
+                    values[1] = str(int(values[1]) - base)
+                edits.append([i] + values)
+        counts = None
+        if stats is not None:
+            after = _rule_counts(stats)
+            counts = [after[0] - before[0], after[1] - before[1],
+                      {rule: hits - before[2][rule]
+                       for rule, hits in after[2].items()
+                       if hits != before[2][rule]}]
+        cache.put(key, [em_preverb.prev_id - base, edits, counts])
+        yield processed
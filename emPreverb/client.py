@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Client of the emPreverb server (see emPreverb.server): send an emtsv TSV
+document to the server and write the output.
+"""
+
+import sys
+from argparse import ArgumentParser, FileType
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from .server import DEFAULT_PORT
+
+
+def process(text, url='http://127.0.0.1:{0}/'.format(DEFAULT_PORT)):
+    """Return the output of the emPreverb server at *url* for *text*."""
+    request = Request(url, data=text.encode('utf-8'), method='POST',
+                      headers={'Content-Type': 'text/tab-separated-values; '
+                                               'charset=utf-8'})
+    with urlopen(request) as response:
+        return response.read().decode('utf-8')
+
+
+def main():
+    '''Main'''
+
+    argparser = ArgumentParser(
+        description='EmPreverb client - process an emtsv TSV document on '
+                    'the emPreverb server')
+    argparser.add_argument('-i', '--input', dest='input_stream',
+                           type=FileType(), default=sys.stdin,
+                           help='Use input file instead of STDIN',
+                           metavar='FILE')
+    argparser.add_argument('-o', '--output', dest='output_stream',
+                           type=FileType('w'), default=sys.stdout,
+                           help='Use output file instead of STDOUT',
+                           metavar='FILE')
+    argparser.add_argument('-u', '--url',
+                           default='http://127.0.0.1:{0}/'.format(
+                               DEFAULT_PORT),
+                           help='URL of the server (default: %(default)s)')
+    opts = argparser.parse_args()
+
+    try:
+        opts.output_stream.write(process(opts.input_stream.read(), opts.url))
+    except HTTPError as e:
+        sys.exit('emPreverb server error: {0}'.format(
+            e.read().decode('utf-8').strip()))
+
+
+if __name__ == '__main__':
+    main()
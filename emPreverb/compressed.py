@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Transparent compressed input and output (gzip, bzip2, xz and, with the
+zstandard package, zstd) for the command line.
+
+The format of the input is detected by its magic bytes (or the extension
+of its name), that of the output by the extension of its name, unless
+it is given explicitly.
+(De)compression runs on a background thread, which exchanges large
+blocks with the main thread through a bounded queue, so it overlaps with
+the rule evaluation (zlib, bz2, lzma and zstd release the GIL while
+working on a block).
+The time and throughput of each (de)compression stage are collected in
+its StageStats.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+from time import perf_counter
+
+
+BLOCK_SIZE = 1 << 20 # bytes (de)compressed at a time
+QUEUE_BLOCKS = 8 # blocks buffered between the threads
+GZIP_LEVEL = 6 # the default of gzip(1)
+
+FORMATS = ('gz', 'bz2', 'xz', 'zst')
+MAGIC = (
+    (b'\x1f\x8b', 'gz'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zst'),
+)
+EXTENSIONS = {
+    '.gz': 'gz',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.zst': 'zst',
+}
+
+
+class StageStats:
+    """Time and throughput of a (de)compression stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.compressed_bytes = 0
+        self.bytes = 0 # uncompressed
+        self.seconds = 0.0
+
+    def summary(self):
+        """Return a human-readable summary."""
+        return '{0}: {1:.1f} MB ({2:.1f} MB compressed) in {3:.3f} s ' \
+               '({4:.1f} MB/s)\n'.format(
+                   self.name, self.bytes / 1024 ** 2,
+                   self.compressed_bytes / 1024 ** 2, self.seconds,
+                   self.bytes / 1024 ** 2 / self.seconds
+                   if self.seconds else 0)
+
+
+def format_of_name(name):
+    """Return the compression format of the file *name* by its extension."""
+    return EXTENSIONS.get(os.path.splitext(name or '')[1].lower())
+
+
+def format_of_magic(head):
+    """Return the compression format of the data starting with *head*."""
+    for magic, compression in MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_input(input_stream, compression=None):
+    """
+    Return the text stream of the decompressed *input_stream* (a text
+    stream opened for reading, which must not have been read yet), or
+    *input_stream* itself if it is not compressed.
+    :param compression: one of FORMATS (default: detect)
+    """
+    binary = getattr(input_stream, 'buffer', None)
+    if binary is None:
+        return input_stream
+    name = getattr(input_stream, 'name', None)
+    if compression is None and hasattr(binary, 'peek'):
+        compression = format_of_magic(binary.peek(8))
+    if compression is None and isinstance(name, str):
+        compression = format_of_name(name)
+    if compression is None:
+        return input_stream
+    raw = DecompressingReader(binary, compression, name)
+    return io.TextIOWrapper(io.BufferedReader(raw, BLOCK_SIZE),
+                            encoding='utf-8')
+
+
+def open_output(output_stream, compression=None):
+    """
+    Return a text stream which writes to *output_stream* (a text stream
+    opened for writing) compressed, if the extension of its name is
+    that of a compression format, or *output_stream* itself.
+    The returned stream must be closed to finish the compressed data.
+    :param compression: one of FORMATS (default: detect)
+    """
+    name = getattr(output_stream, 'name', None)
+    if compression is None and isinstance(name, str):
+        compression = format_of_name(name)
+    if compression is None:
+        return output_stream
+    output_stream.flush()
+    raw = CompressingWriter(output_stream.buffer, compression, name)
+    return io.TextIOWrapper(io.BufferedWriter(raw, BLOCK_SIZE),
+                            encoding='utf-8')
+
+
+def compression_stats(*streams):
+    """Return the StageStats of the (de)compressing text *streams*."""
+    stats = []
+    for stream in streams:
+        raw = getattr(getattr(stream, 'buffer', None), 'raw', None)
+        if isinstance(raw, (DecompressingReader, CompressingWriter)):
+            stats.append(raw.stats)
+    return stats
+
+
+class DecompressingReader(io.RawIOBase):
+    """Raw stream of the data decompressed on a background thread."""
+
+    def __init__(self, stream, compression, name=None):
+        """
+        :param stream: the binary stream of the compressed data
+        :param compression: one of FORMATS
+        """
+        super().__init__()
+        self.name = name
+        self.stats = StageStats('decompression ({0})'.format(compression))
+        self.source = _CountingReader(stream)
+        self.decompressor = _decompressor(compression, self.source)
+        self.blocks = queue.Queue(QUEUE_BLOCKS)
+        self.block = memoryview(b'')
+        self.eof = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                start = perf_counter()
+                block = self.decompressor.read(BLOCK_SIZE)
+                self.stats.seconds += perf_counter() - start
+                self.stats.bytes += len(block)
+                self.stats.compressed_bytes = self.source.count
+                self.blocks.put(block)
+                if not block:
+                    break
+        except Exception as e:
+            self.blocks.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.block:
+            if self.eof:
+                return 0
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                self.eof = True
+                raise block
+            if not block:
+                self.eof = True
+                return 0
+            self.block = memoryview(block)
+        size = min(len(buffer), len(self.block))
+        buffer[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
+
+
+class CompressingWriter(io.RawIOBase):
+    """Raw stream of the data compressed on a background thread."""
+
+    def __init__(self, stream, compression, name=None):
+        """
+        :param stream: the binary stream to write the compressed data to
+        :param compression: one of FORMATS
+        """
+        super().__init__()
+        self.name = name
+        self.stats = StageStats('compression ({0})'.format(compression))
+        self.stream = stream
+        self.target = _CountingWriter(stream)
+        self.compressor = _compressor(compression, self.target)
+        self.blocks = queue.Queue(QUEUE_BLOCKS)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                break
+            if self.error is not None:
+                continue # skip the rest, close() raises the error
+            try:
+                start = perf_counter()
+                self.compressor.write(block)
+                self.stats.seconds += perf_counter() - start
+                self.stats.bytes += len(block)
+            except Exception as e:
+                self.error = e
+        try:
+            start = perf_counter()
+            self.compressor.close()
+            self.stream.flush()
+            self.stats.seconds += perf_counter() - start
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+        self.stats.compressed_bytes = self.target.count
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.blocks.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.blocks.put(None)
+            self.thread.join()
+            super().close()
+            if self.error is not None:
+                raise self.error
+
+
+class _CountingReader:
+    """Count the bytes read from *stream*."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+class _CountingWriter:
+    """Count the bytes written to *stream*."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.count += len(data)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def _decompressor(compression, stream):
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(stream, 'rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(stream, 'rb')
+    if compression == 'zst':
+        return _zstandard().ZstdDecompressor().stream_reader(
+            stream, read_across_frames=True)
+    raise ValueError('Unknown compression format: {0}'.format(compression))
+
+
+def _compressor(compression, stream):
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=stream, mode='wb',
+                             compresslevel=GZIP_LEVEL)
+    if compression == 'bz2':
+        return bz2.BZ2File(stream, 'wb')
+    if compression == 'xz':
+        return lzma.LZMAFile(stream, 'wb')
+    if compression == 'zst':
+        return _zstandard().ZstdCompressor().stream_writer(stream,
+                                                            closefd=False)
+    raise ValueError('Unknown compression format: {0}'.format(compression))
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('zstd compression in emPreverb requires zstandard '
+                          '(pip install emPreverb[zstd])') from e
+    return zstandard
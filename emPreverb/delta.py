@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Sparse "annotation delta" output: only the fields changed by emPreverb
+(`prev`, `previd`, `prevpos`, `lemma`, `xpostag`, `compound`) of the
+changed tokens are written, as (sentence index, token index, changed
+fields) records, instead of the whole TSV.
+
+Two formats are available:
+- text: a header line with the output field names, then one line per
+  changed token: sentence index, token index and field=value pairs,
+  separated by tabs,
+- binary: columns of the sentence indices, token indices and, for each
+  field, the index of the new value in a string table (-1 if unchanged),
+  each compressed with zlib.
+
+merge() (python -m emPreverb.delta) applies a delta to the original TSV,
+giving the same output as emPreverb.
+"""
+
+import sys
+import zlib
+from argparse import ArgumentParser, FileType
+from array import array
+from collections import defaultdict
+
+from .tsv import format_sentence, read_sentences
+
+
+EDITED_FIELDS = ('prev', 'previd', 'prevpos', 'lemma', 'xpostag', 'compound')
+TEXT_MAGIC = '#emPreverb-delta\t1'
+BINARY_MAGIC = b'emPreverb-delta\x00\x01'
+
+
+class DeltaWriter:
+    """Collect the changed fields of processed sentences."""
+
+    def __init__(self, output_fields, field_names):
+        """
+        :param output_fields: the field names of the output (header)
+        :param field_names: the field names of the processed rows,
+                            as given to prepare_fields()
+        """
+        self.output_fields = list(output_fields)
+        self.edited = [(name, field_names[name]) for name in EDITED_FIELDS
+                       if name in field_names]
+
+    def originals(self, sen):
+        """Return what add() needs to know of *sen* before processing."""
+        # the target fields are not yet added to the rows
+        return [[tok[index] if index < len(tok) else ''
+                 for _, index in self.edited] for tok in sen]
+
+    def add(self, sen_index, sen, originals):
+        """Add the changes of the processed sentence *sen*."""
+        for tok_index, (tok, original) in enumerate(zip(sen, originals)):
+            changes = [(name, tok[index])
+                       for (name, index), value in zip(self.edited, original)
+                       if tok[index] != value]
+            if changes:
+                self.write(sen_index, tok_index, changes)
+
+    def write(self, sen_index, tok_index, changes):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TextDeltaWriter(DeltaWriter):
+    """Write the delta in the line-oriented text format."""
+
+    def __init__(self, output_fields, field_names, output_stream):
+        super().__init__(output_fields, field_names)
+        self.output_stream = output_stream
+        output_stream.write('{0}\t{1}\n'.format(TEXT_MAGIC,
+                                                '\t'.join(self.output_fields)))
+
+    def write(self, sen_index, tok_index, changes):
+        self.output_stream.write('{0}\t{1}\t{2}\n'.format(
+            sen_index, tok_index,
+            '\t'.join('{0}={1}'.format(name, value)
+                      for name, value in changes)))
+
+
+class BinaryDeltaWriter(DeltaWriter):
+    """Write the delta in the binary columnar format."""
+
+    def __init__(self, output_fields, field_names, output_stream):
+        super().__init__(output_fields, field_names)
+        self.output_stream = output_stream
+        self.sentences = array('q')
+        self.tokens = array('i')
+        self.values = {name: array('i') for name, _ in self.edited}
+        self.strings = {}
+
+    def write(self, sen_index, tok_index, changes):
+        self.sentences.append(sen_index)
+        self.tokens.append(tok_index)
+        changes = dict(changes)
+        for name, column in self.values.items():
+            if name in changes:
+                column.append(self.strings.setdefault(changes[name],
+                                                      len(self.strings)))
+            else:
+                column.append(-1)
+
+    def close(self):
+        columns = [self.sentences, self.tokens, *self.values.values()]
+        if sys.byteorder != 'little':
+            for column in columns:
+                column.byteswap()
+        blocks = [
+            '\t'.join(self.output_fields).encode('utf-8'),
+            '\t'.join(self.values).encode('utf-8'),
+            '\n'.join(self.strings).encode('utf-8'),
+            *(column.tobytes() for column in columns)
+        ]
+        self.output_stream.write(BINARY_MAGIC)
+        for block in blocks:
+            block = zlib.compress(block)
+            self.output_stream.write(len(block).to_bytes(8, 'little'))
+            self.output_stream.write(block)
+        self.output_stream.flush()
+
+
+def read_delta(delta_stream):
+    """
+    Read a delta in either format (from a binary stream).
+    :return: the output field names and a dict of
+             sentence index -> list of (token index, {field: value})
+    """
+    changes = defaultdict(list)
+    magic = delta_stream.read(len(BINARY_MAGIC))
+    if magic == BINARY_MAGIC:
+        blocks = []
+        while True:
+            length = delta_stream.read(8)
+            if not length:
+                break
+            blocks.append(zlib.decompress(
+                delta_stream.read(int.from_bytes(length, 'little'))))
+        output_fields = blocks[0].decode('utf-8').split('\t')
+        names = blocks[1].decode('utf-8').split('\t') if blocks[1] else []
+        strings = blocks[2].decode('utf-8').split('\n')
+        sentences = array('q', blocks[3])
+        tokens = array('i', blocks[4])
+        columns = [array('i', block) for block in blocks[5:]]
+        if sys.byteorder != 'little':
+            for column in [sentences, tokens, *columns]:
+                column.byteswap()
+        for i, (sen_index, tok_index) in enumerate(zip(sentences, tokens)):
+            changes[sen_index].append((tok_index, {
+                name: strings[column[i]]
+                for name, column in zip(names, columns) if column[i] >= 0}))
+        return output_fields, changes
+
+    lines = (magic + delta_stream.read()).decode('utf-8').split('\n')
+    header = lines[0].split('\t')
+    if '\t'.join(header[:2]) != TEXT_MAGIC:
+        raise ValueError('Not an emPreverb delta file')
+    for line in lines[1:]:
+        if line:
+            sen_index, tok_index, *fields = line.split('\t')
+            changes[int(sen_index)].append((int(tok_index), dict(
+                field.split('=', 1) for field in fields)))
+    return header[2:], changes
+
+
+def merge(input_stream, delta_stream, output_stream, conll_comments=False):
+    """
+    Apply the delta read from *delta_stream* to the original TSV read
+    from *input_stream*, giving the output of emPreverb.
+    """
+    output_fields, changes = read_delta(delta_stream)
+    fields = next(input_stream).strip().split('\t')
+    indices = {name: i for i, name in enumerate(output_fields)}
+    empty_targets = [''] * (len(output_fields) - len(fields))
+    output_stream.write('\t'.join(output_fields) + '\n')
+    for sen_index, (sen, comment) in enumerate(read_sentences(
+            input_stream, conll_comments,
+            file_name=getattr(input_stream, 'name', 'no filename for stream'),
+            columns=len(fields))):
+        for tok in sen:
+            tok.extend(empty_targets)
+        for tok_index, values in changes.get(sen_index, ()):
+            for name, value in values.items():
+                sen[tok_index][indices[name]] = value
+        output_stream.write(format_sentence(sen, comment))
+
+
+def main():
+    '''Main'''
+
+    argparser = ArgumentParser(
+        description='Apply an emPreverb delta file to the original TSV')
+    argparser.add_argument('-i', '--input', dest='input_stream',
+                           type=FileType(), default=sys.stdin,
+                           help='The original TSV (default: STDIN)',
+                           metavar='FILE')
+    argparser.add_argument('-d', '--delta', dest='delta_stream',
+                           type=FileType('rb'), required=True,
+                           help='The delta file (text or binary)',
+                           metavar='FILE')
+    argparser.add_argument('-o', '--output', dest='output_stream',
+                           type=FileType('w'), default=sys.stdout,
+                           help='Use output file instead of STDOUT',
+                           metavar='FILE')
+    argparser.add_argument('--conllu-comments', action='store_true',
+                           help='Enable CoNLL-U style comments '
+                                '(lines starting with "# ")')
+    opts = argparser.parse_args()
+
+    merge(opts.input_stream, opts.delta_stream, opts.output_stream,
+          opts.conllu_comments)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,13 +7,21 @@ token to which they belong.
 """
 
 import json
+import re
 
-from itertools import chain
-from more_itertools import split_at, windowed
+from collections import namedtuple
+from functools import lru_cache
+from time import perf_counter
 
-from types import SimpleNamespace
+from .rules import (All, Any, Case, ContainsPreverb, Eligible, Morphs, Not,
+                    Rule, Tags, compile_rules, rule_names)
+from .stats import CASE_RULES, RULES, RuleStats
 
 
+# the fields read and added by emPreverb in emtsv
+SOURCE_FIELDS = {'form', 'anas', 'lemma', 'xpostag'}
+TARGET_FIELDS = ['prev', 'previd', 'prevpos']
+
 ENV = 4 # search for [/Prev] in a -env..env environment of the [/V]
 
 VERB_POSTAG = '[/V]'
@@ -37,30 +45,335 @@ MANNER_MORPHEME = '[_Manner/Adv]'
 SUPERLATIVE_MORPHEME = '[/Supl]'
 CONTRAST_PARTICLES = ['ám', 'viszont', 'azonban'] # [/Cnj]
 
-
-class Word(SimpleNamespace):
+# tokens after the last processed one needed by process_tokens():
+# ENV for the rules, then 2 * ENV for clean_up(), which changes tokens
+# within ENV of the token it finalises, and needs the preverbs of the
+# `sep` verbs (ENV tokens later) to be connected for good
+LOOKAHEAD = 3 * ENV
+WINDOW = 4096 # tokens processed at a time by process_tokens()
+
+ANAS_CACHE_SIZE = 2 ** 14 # analyses remembered across sentences
+XPOSTAG_CACHE_SIZE = 2 ** 12
+
+# Token features used by the rules as bits of Word.tags
+# (from xpostag, form and lemma) and Word.morphs (from anas).
+# Word.tags: xpostag starts with...
+VERB = 1 << 0
+INFINITIVE = 1 << 1
+ADJECTIVE = 1 << 2
+SUPERLATIVE = 1 << 3
+NOUN = 1 << 4
+ADVERB = 1 << 5
+ADVERBIAL_PRONOUN = 1 << 6
+DET_PRO = 1 << 7
+N_PRO = 1 << 8
+QUESTION_PARTICLE = 1 << 9
+ARTICLE = 1 << 10
+# Word.tags: xpostag is exactly...
+PREVERB = 1 << 11
+ADVERB_ONLY = 1 << 12
+QUESTION_PARTICLE_ONLY = 1 << 13
+# Word.tags: xpostag contains...
+MANNER_TAG = 1 << 14
+ADVERBIAL_PARTICIPLE_TAG = 1 << 15
+# Word.tags: form or lemma is...
+KELL = 1 << 16
+HOGY = 1 << 17
+COMMA = 1 << 18
+VOLNA = 1 << 19
+CONTRAST = 1 << 20
+NEGATION = 1 << 21
+VAN_LESZ = 1 << 22
+# Word.morphs: anas contains...
+PREVERB_ANA = 1 << 0
+VERB_ANA = 1 << 1
+MODAL_PARTICIPLE = 1 << 2
+PERFECT_PARTICIPLE = 1 << 3
+IMPERFECT_PARTICIPLE = 1 << 4
+ADVERBIAL_PARTICIPLE = 1 << 5
+FUTURE_PARTICIPLE = 1 << 6
+GERUND = 1 << 7
+
+XPOSTAG_PREFIXES = (
+    (VERB_POSTAG, VERB),
+    (INFINITIVE_POSTAG, INFINITIVE),
+    (ADJECTIVE_POSTAG, ADJECTIVE),
+    (SUPERLATIVE_MORPHEME, SUPERLATIVE),
+    (NOUN_POSTAG, NOUN),
+    (ADVERB_POSTAG, ADVERB),
+    (ADVERBIAL_PRONOUN_POSTAG, ADVERBIAL_PRONOUN),
+    (DET_PRO_POSTAG, DET_PRO),
+    (N_PRO_POSTAG, N_PRO),
+    (QUESTION_PARTICLE_POSTAG, QUESTION_PARTICLE),
+    (ARTICLE_POSTAG, ARTICLE),
+)
+XPOSTAG_VALUES = {
+    PREVERB_POSTAG: PREVERB,
+    ADVERB_POSTAG: ADVERB_ONLY,
+    QUESTION_PARTICLE_POSTAG: QUESTION_PARTICLE_ONLY,
+}
+XPOSTAG_MORPHEMES = (
+    (MANNER_MORPHEME, MANNER_TAG),
+    (ADVERBIAL_PARTICIPLE_MORPHEME, ADVERBIAL_PARTICIPLE_TAG),
+)
+FORM_TAGS = {
+    'hogy': HOGY,
+    ',': COMMA,
+    'volna': VOLNA,
+    **{form: CONTRAST for form in CONTRAST_PARTICLES},
+    **{form: NEGATION for form in ('nem', 'sem', 'se', 'is')},
+}
+LEMMA_TAGS = {
+    'kell': KELL,
+    'van': VAN_LESZ,
+    'lesz': VAN_LESZ,
+}
+ANAS_MORPHEMES = {
+    PREVERB_POSTAG: PREVERB_ANA,
+    VERB_POSTAG: VERB_ANA,
+    MODAL_PARTICIPLE_MORPHEME: MODAL_PARTICIPLE,
+    PERFECT_PARTICIPLE_MORPHEME: PERFECT_PARTICIPLE,
+    IMPERFECT_PARTICIPLE_MORPHEME: IMPERFECT_PARTICIPLE,
+    ADVERBIAL_PARTICIPLE_MORPHEME: ADVERBIAL_PARTICIPLE,
+    FUTURE_PARTICIPLE_MORPHEME: FUTURE_PARTICIPLE,
+    GERUND_MORPHEME: GERUND,
+}
+XPOSTAG_TAGS = VERB | INFINITIVE | ADJECTIVE | SUPERLATIVE | NOUN | ADVERB |\
+               ADVERBIAL_PRONOUN | DET_PRO | N_PRO | QUESTION_PARTICLE |\
+               ARTICLE | PREVERB | ADVERB_ONLY | QUESTION_PARTICLE_ONLY |\
+               MANNER_TAG | ADVERBIAL_PARTICIPLE_TAG
+ANAS_MORPHEMES_RE = re.compile('|'.join(map(re.escape, ANAS_MORPHEMES)))
+
+# possible central tokens of the rules that connect a separated preverb
+CONNECTED = VERB | ADJECTIVE | NOUN | ADVERB_ONLY
+# possible central tokens of the `pfx` rule
+PREFIXED = VERB | ADJECTIVE | SUPERLATIVE | NOUN
+
+# The decision tree, see rules.py. Offsets are relative to the central
+# token, the rule names are those of stats.RULES and stats.CASE_RULES.
+DECISION_TREE = (
+    # contains a prefixed preverb
+    Rule('pfx', Any(All(Tags(0, VERB | ADJECTIVE | SUPERLATIVE),
+                        Morphs(0, PREVERB_ANA),
+                        ContainsPreverb(0)),
+                    All(Tags(0, NOUN),
+                        Morphs(0, PREVERB_ANA))),
+         None),
+    # szét kell, hogy szedni
+    Rule('kell_comma_hogy', All(Tags(0, VERB),
+                                Eligible(-4, 4),
+                                Tags(-3, KELL),
+                                Tags(-2, COMMA),
+                                Tags(-1, HOGY)),
+         -4),
+    # szét kell hogy szedni
+    Rule('kell_hogy', All(Tags(0, VERB),
+                          Eligible(-3, 3),
+                          Tags(-2, KELL),
+                          Tags(-1, HOGY)),
+         -3),
+    # meg nem haladó, Kalivoda (2021: 69-73)
+    Rule('participle_after_negation',
+         All(Any(All(Tags(0, ADJECTIVE),
+                     Not(Tags(0, MANNER_TAG)),
+                     Morphs(0, PERFECT_PARTICIPLE | IMPERFECT_PARTICIPLE |
+                               FUTURE_PARTICIPLE)),
+                 All(Tags(0, NOUN | ADJECTIVE),
+                     Morphs(0, GERUND))),
+             Eligible(-2, 2),
+             Tags(-1, NEGATION)),
+         -2),
+    # infinitive, adverbial participle
+    Rule('nonfinite_left3', All(Tags(0, VERB),
+                                Any(Tags(0, INFINITIVE),
+                                    Morphs(0, ADVERBIAL_PARTICIPLE)),
+                                Eligible(-3, 3),
+                                Tags(-2, ADVERB | ADVERBIAL_PRONOUN | VERB |
+                                         ARTICLE),
+                                Tags(-1, ADVERB | ADVERBIAL_PRONOUN | VERB |
+                                         CONTRAST | DET_PRO | N_PRO |
+                                         QUESTION_PARTICLE | ARTICLE)),
+         -3),
+    Rule('nonfinite_left2', All(Tags(0, VERB),
+                                Any(Tags(0, INFINITIVE),
+                                    Morphs(0, ADVERBIAL_PARTICIPLE)),
+                                Eligible(-2, 2),
+                                Tags(-1, ADVERB | ADVERBIAL_PRONOUN | VERB),
+                                Not(Tags(1, INFINITIVE))),
+         -2),
+    # a verb or a verb-derivative that may have a separated preverb
+    Case(Any(All(Tags(0, VERB),
+                 Morphs(0, VERB_ANA), # is it a verb according to anas?
+                 Not(Tags(0, VOLNA | KELL)),
+                 Not(Any(All(Tags(1, INFINITIVE),
+                             Not(ContainsPreverb(1))),
+                         Tags(2, INFINITIVE))),
+                 Not(All(Tags(0, VAN_LESZ),
+                         Any(Tags(1, ADVERBIAL_PARTICIPLE_TAG),
+                             Tags(2, ADVERBIAL_PARTICIPLE_TAG))))),
+             All(Tags(0, ADJECTIVE), # Kalivoda (2021: 68-9)
+                 Morphs(0, MODAL_PARTICIPLE | FUTURE_PARTICIPLE),
+                 Not(Tags(0, MANNER_TAG)),
+                 Not(Morphs(0, PREVERB_ANA))),
+             All(Tags(0, ADVERB_ONLY), # Kalivoda (2021: 64-6)
+                 Morphs(0, ADVERBIAL_PARTICIPLE))),
+         (
+             # Case 2: "szét" [msd="IGE.*|HA.*"] [msd="IGE.*" & word != "volna"]
+             # szét kell szerelni, szét se szereli
+             Rule('case2_left2', All(Eligible(-2, 2),
+                                     Tags(-1, ADVERB | ADVERBIAL_PRONOUN |
+                                              VERB)),
+                  -2),
+             # Case 3: [msd="IGE.*" & word != "volna] "szét"
+             # szereli szét
+             Rule('case3_right1', Eligible(1), 1),
+             # Case 4: [msd="IGE.*" & word != "volna] [msd="HA.*" | word="volna"] "szét"
+             # rágja is szét, rágta volna szét, tépi hirtelen szét
+             Rule('case4_right2', All(Eligible(2),
+                                      Tags(1, ADVERB | ADVERBIAL_PRONOUN |
+                                              QUESTION_PARTICLE_ONLY | VOLNA |
+                                              CONTRAST | NOUN | DET_PRO |
+                                              N_PRO)),
+                  2),
+             Rule('right3', All(Eligible(3),
+                                Tags(1, ADVERB | ADVERBIAL_PRONOUN | N_PRO |
+                                        NOUN | DET_PRO | ARTICLE),
+                                Tags(2, ADVERB | ADVERBIAL_PRONOUN | N_PRO |
+                                        NOUN | DET_PRO)),
+                  3),
+             Rule('left1', All(Eligible(-1),
+                               Not(Any(Tags(-3, VERB), Tags(-2, VERB))),
+                               Any(Tags(1, VOLNA), Not(Tags(1, VERB))),
+                               Not(Any(Tags(2, VERB), Tags(3, VERB))),
+                               Not(Any(Morphs(1, ADVERBIAL_PARTICIPLE),
+                                       Morphs(2, ADVERBIAL_PARTICIPLE),
+                                       Morphs(3, ADVERBIAL_PARTICIPLE)))),
+                  -1),
+         )),
+)
+
+
+class Word:
     """
-    Convenience class to access predefined word features as attributes.
-    Set Word.features = ... before using this class!
+    Compact record of one token: a view over the token's row (the list of
+    its field values) which gives access to the fields as attributes.
+    The row itself is stored, so no per-token dict is built and the row
+    can be returned as it is.
+    The features the rules need are computed once per token:
+    `tags` on creation, `morphs` when first needed.
+    Use word_class() to create a subclass for a given field layout!
     """
-    features = []
-    def __init__(self, vals):
-        if len(vals) != len(self.features):
+    __slots__ = ('row', 'readable', 'tags', '_morphs')
+    features = ()
+
+    def __init__(self, row):
+        if len(row) != len(self.features):
             raise RuntimeError(
-                f"{len(self.features)} values expected, {len(vals)} provided")
-        super().__init__(**dict(zip(self.features, vals)))
+                f"{len(self.features)} values expected, {len(row)} provided")
+        self.row = row
+        self.readable = None # cache of selected_readable(), see there
+        self.tags = (xpostag_tags(self.xpostag) |
+                     FORM_TAGS.get(self.form, 0) |
+                     LEMMA_TAGS.get(self.lemma, 0))
+        self._morphs = None
+
+    @classmethod
+    def from_tags(cls, row, tags):
+        """Create the Word of *row* with its already computed *tags*."""
+        word = cls.__new__(cls)
+        word.row = row
+        word.readable = None
+        word.tags = tags
+        word._morphs = None
+        return word
+
+    @property
+    def morphs(self):
+        if self._morphs is None:
+            self._morphs = anas_morphs(self.anas)
+        return self._morphs
+
+    def as_list(self):
+        return self.row
+
+
+def word_class(features):
+    """
+    Create a Word subclass in which each of *features* is a property
+    that reads and writes the corresponding column of the row.
+    """
+    namespace = {'__slots__': (), 'features': tuple(features)}
+    for i, name in enumerate(namespace['features']):
+        namespace[name] = _field_property(i)
+    return type('Word', (Word,), namespace)
+
+
+@lru_cache(maxsize=XPOSTAG_CACHE_SIZE)
+def xpostag_tags(xpostag):
+    """Return the Word.tags bits that depend on *xpostag*."""
+    tags = XPOSTAG_VALUES.get(xpostag, 0)
+    for prefix, bit in XPOSTAG_PREFIXES:
+        if xpostag.startswith(prefix):
+            tags |= bit
+    for morpheme, bit in XPOSTAG_MORPHEMES:
+        if morpheme in xpostag:
+            tags |= bit
+    return tags
+
+
+def anas_morphs(anas):
+    """Return the Word.morphs bits of *anas* in one pass over it."""
+    morphs = 0
+    for morpheme in set(ANAS_MORPHEMES_RE.findall(anas)):
+        morphs |= ANAS_MORPHEMES[morpheme]
+    return morphs
+
+
+def _field_property(i):
+    def getter(word):
+        return word.row[i]
+
+    def setter(word, value):
+        word.row[i] = value
+
+    return property(getter, setter)
+
+
+# The compiled configuration for a field layout, returned by
+# EmPreverb.prepare_fields(). It is immutable, so it can be shared by
+# documents processed on different threads.
+Layout = namedtuple('Layout', ['word_class', 'padding', 'compound_exists',
+                               'target_count', 'apply_rules'])
+
+
+class Document:
+    """
+    The state of processing a document: the `previd` counter, the padded
+    sentence buffer and the rule statistics.
+    Documents processed at the same time (e.g. on different threads)
+    need a Document each, see EmPreverb.new_document().
+    """
+    __slots__ = ('layout', 'prev_id', 'buffer', 'stats')
 
-    def as_list(self): # XXX best practice? can I define list(...) for this class?
-        return self.__dict__.values()
+    def __init__(self, layout, stats=None, prev_id=0):
+        self.layout = layout
+        self.prev_id = prev_id
+        # reused by each sentence, grows to the longest sentence
+        self.buffer = list(layout.padding) * 2 if layout is not None else []
+        self.stats = stats
 
 
 class EmPreverb:
     '''Required by xtsv.'''
 
-    def __init__(self, *_, source_fields=None, target_fields=None):
+    rules = DECISION_TREE # see rules.py
+
+    def __init__(self, *_, source_fields=None, target_fields=None,
+                 stats=False):
         """
         Required by xtsv.
         Initialise the module.
+        :param stats: collect rule statistics in self.stats (a RuleStats)
         """
 
         # Field names for xtsv (the code below is mandatory for an xtsv module)
@@ -73,212 +386,254 @@ class EmPreverb:
         self.source_fields = source_fields
         self.target_fields = target_fields
 
-        self.prev_id = 0
-        self.window_size = 2 * ENV + 1
-        self.center = ENV # index of central element in window
+        self.stats = RuleStats() if stats else None
+        # the layout of the last prepare_fields() call and the document
+        # used when none is given (not thread-safe, as in xtsv)
+        self.layout = None
+        self.document = Document(None, self.stats)
+
+    @property
+    def prev_id(self):
+        """The `previd` counter of the default document."""
+        return self.document.prev_id
+
+    @prev_id.setter
+    def prev_id(self, value):
+        self.document.prev_id = value
 
-    def process_sentence(self, sen, _):
+    def new_document(self, layout=None):
+        """
+        Return the state for processing a new document (with `previd`
+        numbered from 1) with *layout* (default: that of the last
+        prepare_fields() call).
+        Statistics are collected in the stats of the document.
+        """
+        return Document(layout or self.layout,
+                        RuleStats() if self.stats is not None else None)
+
+    def _document(self, field_values, document):
+        """
+        Return *document*, or the default document for the Layout
+        *field_values* (self.document, switched to this layout if
+        needed, keeping its `previd` counter and statistics).
+        """
+        if document is None:
+            document = self.document
+            if isinstance(field_values, Layout) and \
+                    field_values is not document.layout:
+                document = self.document = Document(
+                    field_values, document.stats, document.prev_id)
+        elif isinstance(field_values, Layout) and \
+                field_values is not document.layout:
+            raise ValueError('The layout of the document differs from '
+                             'field_values')
+        return document
+
+    def process_sentence(self, sen, field_values=None, document=None):
         """
         Required by xtsv.
         Process one sentence per function call.
+        :param field_values: the Layout of the sentence returned by
+                             prepare_fields() (default: the layout of
+                             *document*)
+        :param document: the Document of the sentence (default:
+                         self.document with the layout *field_values*,
+                         or the last prepared layout)
         :return: sen object augmented with output field values for each token
         """
+        document = self._document(field_values, document)
+        if document.stats is None:
+            return self._process_sentence(sen, document)
+
+        start = perf_counter()
+        processed = self._process_sentence(sen, document)
+        document.stats.add_sentence(len(sen), perf_counter() - start)
+        return processed
 
-        word_objects = (Word(
-            tok + [''] * len(self.target_fields) # add empty target fields
-        ) for tok in sen)
+    def process_sentences(self, sentences, field_values=None, document=None):
+        """
+        Process an iterable of sentences.
+        :return: iterator of the processed sentences (see process_sentence)
+        """
+        document = self._document(field_values, document)
+        if document.stats is not None:
+            for sen in sentences:
+                yield self.process_sentence(sen, field_values, document)
+            return
+
+        # _process_sentence() inlined
+        buf = document.buffer
+        layout = document.layout
+        padding = layout.padding
+        words = self.words
+        apply_rules = self.apply_rules
+        clean_up = self.clean_up
+        candidates = self.candidates
+        for sen in sentences:
+            end = ENV + len(sen)
+            buf[ENV:end] = words(sen, layout)
+            buf[end:end + ENV] = padding
+            indices = candidates(buf, ENV, end)
+            if indices: # otherwise the sentence is not changed
+                for i in indices:
+                    apply_rules(document, buf, i)
+                clean_up(document, buf, ENV, end)
+            yield sen
+
+    def process_tokens(self, rows, field_values=None, document=None,
+                       window=WINDOW):
+        """
+        Process one sentence given as an iterable of its token rows
+        with a bounded buffer, for very long sentences: the rows are
+        processed *window* tokens at a time, and each row is returned
+        as soon as no later token can change it (LOOKAHEAD tokens
+        later), so at most about window + LOOKAHEAD + 2 * ENV rows are
+        kept. The result is the same as that of process_sentence().
+        :param field_values, document: see process_sentence()
+        :return: iterator of the processed rows
+        """
+        document = self._document(field_values, document)
+        stats = document.stats
+        seconds = 0
+        layout = document.layout
+        word_class = layout.word_class
+        empty_targets = [''] * layout.target_count
+        # buf: ENV tokens (padding or already returned), the tokens
+        # processed by the rules up to ruled, and cleaned up up to cleaned
+        buf = list(layout.padding)
+        ruled = cleaned = ENV
+        size = window + LOOKAHEAD + 2 * ENV
+        count = 0
+        for row in rows:
+            row.extend(empty_targets)
+            buf.append(word_class(row))
+            count += 1
+            if len(buf) < size:
+                continue
+            start = perf_counter()
+            self._apply_rules_in(document, buf, ruled, len(buf) - ENV)
+            ruled = len(buf) - ENV
+            self.clean_up(document, buf, cleaned, ruled - 2 * ENV)
+            cleaned = ruled - 2 * ENV
+            done = cleaned - ENV
+            seconds += perf_counter() - start
+            for word in buf[ENV:done]:
+                yield word.row
+            del buf[:done - ENV]
+            ruled -= done - ENV
+            cleaned -= done - ENV
+
+        start = perf_counter()
+        end = len(buf)
+        buf.extend(layout.padding)
+        self._apply_rules_in(document, buf, ruled, end)
+        self.clean_up(document, buf, cleaned, end)
+        if stats is not None:
+            stats.add_sentence(count, seconds + perf_counter() - start)
+        for word in buf[ENV:end]:
+            yield word.row
+
+    def _apply_rules_in(self, document, buf, start, end):
+        """Run the decision tree on the tokens of buf[start:end]."""
+        if document.stats is None:
+            indices = self.candidates(buf, start, end)
+        else:
+            # the statistics count the attempts on every token
+            indices = range(start, end)
+        for i in indices:
+            self.apply_rules(document, buf, i)
+
+    def _process_sentence(self, sen, document):
+        # the rows of *sen* are changed in place and returned
+        # buf: [padding] words of sen [padding] (possibly followed by
+        # stale tokens of an earlier, longer sentence, which are never read)
+        buf = document.buffer
+        end = ENV + len(sen)
+        buf[ENV:end] = self.words(sen, document.layout)
+        buf[end:end + ENV] = document.layout.padding
+        self._apply_rules_in(document, buf, ENV, end)
+        self.clean_up(document, buf, ENV, end)
+        return sen
+
+    def candidates(self, buf, start, end):
+        """
+        Return the indices of the tokens of buf[start:end] to which a rule
+        may apply, in order: the possible central tokens of a connection
+        with a preverb within ENV tokens, and the tokens which may contain
+        a prefixed preverb. apply_rules() would not change the others.
+        """
+        # the preverbs of the tokens at the edges may be outside the range
+        preverbs = [i for i in range(start - ENV, end + ENV)
+                    if buf[i].tags & PREVERB]
+        if not preverbs:
+            return [i for i in range(start, end) if buf[i].tags & PREFIXED
+                    and PREVERB_POSTAG in buf[i].anas]
+
+        near_preverb = set()
+        for i in preverbs:
+            near_preverb.update(range(i - ENV, i + ENV + 1))
+        return [i for i in range(start, end)
+                if buf[i].tags & CONNECTED and i in near_preverb
+                or buf[i].tags & PREFIXED and PREVERB_POSTAG in buf[i].anas]
+
+    def words(self, sen, layout):
+        """
+        Return the Word objects of the token rows of *sen*.
+        Empty target fields are added to the rows in place.
+        """
         # we assume that target_fields are NOT among input fields!
+        empty_targets = [''] * layout.target_count
+        for tok in sen:
+            tok.extend(empty_targets)
+        return list(map(layout.word_class, sen))
 
-        padded_sentence = chain(self.padding, word_objects, self.padding) # !
-
-        processed = []
-
-
-        for window in windowed(padded_sentence, self.window_size): # !
-
-            left = list(reversed(window[:self.center + 1])) # abc..
-            central = window[self.center]                   # ..c..
-            right = window[self.center:]                    # ..cde
-
-            if ((central.xpostag.startswith((VERB_POSTAG, ADJECTIVE_POSTAG,
-                                            SUPERLATIVE_MORPHEME)) and
-                    PREVERB_POSTAG in central.anas and
-                    contains_preverb(central))
-                or (central.xpostag.startswith(NOUN_POSTAG) and
-                    PREVERB_POSTAG in central.anas)):
-                    self.add_preverb(central, 0)
-
-            elif (central.xpostag.startswith(VERB_POSTAG)
-                and is_eligible_preverb(left[4], 4)
-                and left[3].lemma == "kell"
-                and left[2].form == ","
-                and left[1].form == "hogy"
-                ):
-                self.add_preverb(central, -4, left[4])
-
-            elif (central.xpostag.startswith(VERB_POSTAG)
-                and is_eligible_preverb(left[3], 3)
-                and left[2].lemma == "kell"
-                and left[1].form == "hogy"
-                ):
-                self.add_preverb(central, -3, left[3])
-
-            elif (
-                ((central.xpostag.startswith(ADJECTIVE_POSTAG)
-                    and MANNER_MORPHEME not in central.xpostag
-                    and (PERFECT_PARTICIPLE_MORPHEME in central.anas
-                         or IMPERFECT_PARTICIPLE_MORPHEME in central.anas
-                         or FUTURE_PARTICIPLE_MORPHEME in central.anas))
-                or
-                (central.xpostag.startswith((NOUN_POSTAG,ADJECTIVE_POSTAG))
-                    and GERUND_MORPHEME in central.anas))
-                and is_eligible_preverb(left[2], 2)
-                and left[1].form in ('nem', 'sem', 'se', 'is')):
-                    # Kalivoda (2021: 69-73)
-                self.add_preverb(central, -2, left[2])
-
-            elif (central.xpostag.startswith(VERB_POSTAG)
-                and (ADVERBIAL_PARTICIPLE_MORPHEME in central.anas
-                    or central.xpostag.startswith(INFINITIVE_POSTAG))
-                and is_eligible_preverb(left[3], 3)
-                and left[2].xpostag.startswith((ADVERB_POSTAG,
-                                ADVERBIAL_PRONOUN_POSTAG, VERB_POSTAG,
-                                ARTICLE_POSTAG))
-                and (left[1].xpostag.startswith((ADVERB_POSTAG,
-                                ADVERBIAL_PRONOUN_POSTAG, VERB_POSTAG))
-                     or left[1].form in CONTRAST_PARTICLES
-                     or left[1].xpostag.startswith((DET_PRO_POSTAG,
-                                N_PRO_POSTAG, QUESTION_PARTICLE_POSTAG,
-                                ARTICLE_POSTAG)))
-                ):
-                self.add_preverb(central, -3, left[3])
-
-            elif (central.xpostag.startswith(VERB_POSTAG)
-                and (ADVERBIAL_PARTICIPLE_MORPHEME in central.anas
-                    or central.xpostag.startswith(INFINITIVE_POSTAG))
-                and is_eligible_preverb(left[2], 2)
-                and (left[1].xpostag.startswith((ADVERB_POSTAG,
-                                ADVERBIAL_PRONOUN_POSTAG, VERB_POSTAG)))
-                and not right[1].xpostag.startswith(INFINITIVE_POSTAG)
-                ):
-                self.add_preverb(central, -2, left[2])
-
-            elif (
-                (central.xpostag.startswith(VERB_POSTAG)
-                    and VERB_POSTAG in central.anas  # is it a verb according to anas?
-                    and central.form != "volna"
-                    and central.lemma != "kell"
-                    and not (right[1].xpostag.startswith(INFINITIVE_POSTAG)
-                             and not contains_preverb(right[1])
-                             or right[2].xpostag.startswith(INFINITIVE_POSTAG)))
-                    and not (central.lemma in ("van", "lesz")
-                             and (ADVERBIAL_PARTICIPLE_MORPHEME in right[1].xpostag
-                                  or ADVERBIAL_PARTICIPLE_MORPHEME in right[2].xpostag)
-                             )
-                or
-                (central.xpostag.startswith(ADJECTIVE_POSTAG)
-                    and (MODAL_PARTICIPLE_MORPHEME in central.anas
-                         or FUTURE_PARTICIPLE_MORPHEME in central.anas) # Kalivoda (2021: 68-9)
-                    and MANNER_MORPHEME not in central.xpostag
-                    and PREVERB_POSTAG not in central.anas)
-                or
-                (central.xpostag == ADVERB_POSTAG
-                    and ADVERBIAL_PARTICIPLE_MORPHEME in central.anas)   # Kalivoda (2021: 64-6)
-                ):
-
-                # Case 2: "szét" [msd="IGE.*|HA.*"] [msd="IGE.*" & word != "volna"]
-                # szét kell szerelni, szét se szereli
-                if (is_eligible_preverb(left[2], 2) and
-                      left[1].xpostag.startswith((ADVERB_POSTAG,
-                                    ADVERBIAL_PRONOUN_POSTAG, VERB_POSTAG))):
-                    self.add_preverb(central, -2, left[2])
-
-                # Case 3: [msd="IGE.*" & word != "volna] "szét"
-                elif is_eligible_preverb(right[1]):
-                    self.add_preverb(central, 1, right[1])
-
-                # Case 4: [msd="IGE.*" & word != "volna] [msd="HA.*" | word="volna"] "szét"
-                # rágja is szét, rágta volna szét, tépi hirtelen szét
-                elif (is_eligible_preverb(right[2]) and
-                        (right[1].xpostag.startswith((ADVERB_POSTAG,
-                                            ADVERBIAL_PRONOUN_POSTAG))
-                         or right[1].xpostag == QUESTION_PARTICLE_POSTAG
-                         or right[1].form == 'volna'
-                         or right[1].form in CONTRAST_PARTICLES
-                         or right[1].xpostag.startswith((NOUN_POSTAG,
-                                            DET_PRO_POSTAG, N_PRO_POSTAG))
-                         )
-                      ):
-                    self.add_preverb(central, 2, right[2])
-
-                elif (is_eligible_preverb(right[3])
-                    and right[1].xpostag.startswith((ADVERB_POSTAG,
-                                    ADVERBIAL_PRONOUN_POSTAG,
-                                    N_PRO_POSTAG, NOUN_POSTAG, DET_PRO_POSTAG,
-                                    ARTICLE_POSTAG))
-                    and right[2].xpostag.startswith((ADVERB_POSTAG,
-                                    ADVERBIAL_PRONOUN_POSTAG,
-                                    N_PRO_POSTAG, NOUN_POSTAG, DET_PRO_POSTAG))
-                    ):
-                    self.add_preverb(central, 3, right[3])
-
-                elif (is_eligible_preverb(left[1])
-                      and not left[3].xpostag.startswith(VERB_POSTAG)
-                      and not left[2].xpostag.startswith(VERB_POSTAG)
-                      and (right[1].form == 'volna' or
-                            not right[1].xpostag.startswith(VERB_POSTAG))
-                      and not ADVERBIAL_PARTICIPLE_MORPHEME in right[1].anas
-                      and not right[2].xpostag.startswith(VERB_POSTAG)
-                      and not ADVERBIAL_PARTICIPLE_MORPHEME in right[2].anas
-                      and not right[3].xpostag.startswith(VERB_POSTAG)
-                      and not ADVERBIAL_PARTICIPLE_MORPHEME in right[3].anas
-                      ):
-                    self.add_preverb(central, -1, left[1])
-
-                # Doesn't have a preverb
-                else:
-                    pass
-
-            # needs to be collected and postprocessed before printing
-            processed.append(central)
+    def apply_rules(self, document, buf, i):
+        """
+        Run the decision tree on the token buf[i] (the central token).
+        The neighbours of the central token are addressed by their index
+        in *buf*, which has at least ENV tokens (or padding) on both sides.
+        The decision tree (self.rules) is compiled by prepare_fields().
+        """
+        document.layout.apply_rules(self, document, buf, i)
 
+    def clean_up(self, document, buf, start, end):
+        """
+        Finalise the annotation of the tokens buf[start:end] of a processed
+        sentence.
+        """
         # Clean up processed:
         # Remove "sep" annotation from verbs that are "orphaned" because
         # a better main verb candidate was found for the preverb later in
         # the sentence.
         # Set verb and preverb lemmas.
+        # One pass is enough: the preverb of a `sep` verb and the verb of
+        # a `conn` preverb are found by their position (prevpos), and a
+        # `sep` verb is orphaned iff its preverb has another previd.
 
-        conn_id_to_lemma = {proc_word.previd: proc_word.lemma
-                            for proc_word in processed
-                            if proc_word.prev == "conn"}
-
-        for proc_word in processed:
+        for i in range(start, end):
+            proc_word = buf[i]
             if proc_word.prev == "conn": # word is a preverb
+                verb = buf[i - int(proc_word.prevpos)]
+                vlemma = verb.lemma.lower()
+                verb.lemma = proc_word.lemma + vlemma
+                if document.layout.compound_exists:
+                    verb.compound = proc_word.lemma + '#' + vlemma
                 proc_word.lemma = ""
                 proc_word.prevpos = ""
-            elif proc_word.prev == "sep": # word is verb
-                if proc_word.previd in conn_id_to_lemma:
-                    # verb is not orphaned
-                    vlemma = proc_word.lemma.lower()
-                    proc_word.lemma = conn_id_to_lemma[proc_word.previd]\
-                                      + vlemma
-                    if self.compound_exists:
-                        proc_word.compound = conn_id_to_lemma[proc_word.previd]\
-                                             + '#' + vlemma
-                else:
-                    # verb is orphaned
-                    proc_word.prev = ""
-                    proc_word.previd = ""
-                    proc_word.prevpos = ""
-
-
-        return [word.as_list() for word in processed]
+            elif (proc_word.prev == "sep" and # word is verb
+                  buf[i + int(proc_word.prevpos)].previd != proc_word.previd):
+                # verb is orphaned
+                if document.stats is not None:
+                    document.stats.orphans += 1
+                proc_word.prev = ""
+                proc_word.previd = ""
+                proc_word.prevpos = ""
 
     def prepare_fields(self, field_names):
         """
         Required by xtsv.
         :param field_names: the dictionary of the names of the input fields
-        :return: the list of the initialised feature classes as required for
+        :return: the compiled Layout of these fields as required for
                 process_sentence
         """
         field_names = {k: v for k, v in field_names.items() if isinstance(k, str)}
@@ -287,24 +642,29 @@ class EmPreverb:
         # XXX ha az input field-ek között szerepel target field, akkor összezavarodik!
         # -> ez nem általános probléma? ha igen: csináljak xtsv issút belőle!
 
-        # set Word.features for the whole script
-        # XXX best practice for this?
-        Word.features = field_names.keys()
+        # Word class with the field layout of this input
+        layout_word_class = word_class(field_names.keys())
+        fakeword = layout_word_class([''] * len(field_names))
+        layout = Layout(layout_word_class, (fakeword,) * ENV,
+                        'compound' in field_names, len(self.target_fields),
+                        compiled_rules(self.rules))
 
-        fakeword = Word([''] * len(Word.features))
-        self.padding = [fakeword] * ENV
+        self.layout = layout
+        self.document = Document(layout, self.stats, self.document.prev_id)
+        return layout
 
-        self.compound_exists = 'compound' in Word.features
-
-        # nothing to return -- all are noted in Word
-        return None
-
-    def add_preverb(self, verb, prevpos, preverb=None):
-        """Update *verb* with info from *preverb*."""
+    def add_preverb(self, document, verb, prevpos, preverb=None, rule=None):
+        """
+        Update *verb* with info from *preverb*.
+        :param rule: the name of the applied rule, see stats.RULES
+        """
+        if document.stats is not None:
+            document.stats.hits[rule] += 1
         verb.xpostag = PREVERB_POSTAG + verb.xpostag
+        verb.tags = (verb.tags & ~XPOSTAG_TAGS) | xpostag_tags(verb.xpostag)
         if preverb is not None:
-            self.prev_id += 1
-            previd = str(self.prev_id)
+            document.prev_id += 1
+            previd = str(document.prev_id)
 
             # handle verb  --> moved to postprocessing
 #            vlemma = verb.lemma.lower()
@@ -342,15 +702,69 @@ def contains_preverb(verb):
     Check whether the verb form contains a preverb according to
     the analysis selected by the pos tagger.
     """
-    anas_list = json.loads(verb.anas)
+    if verb.readable is None:
+        verb.readable = selected_readable(verb.anas, verb.lemma, verb.xpostag)
+    return verb.readable is not False and PREVERB_POSTAG in verb.readable
+
+
+@lru_cache(maxsize=ANAS_CACHE_SIZE)
+def selected_readable(anas, lemma, xpostag):
+    """
+    Return the `readable` of the last analysis in *anas* that has
+    the given *lemma* and *xpostag* (tag), or False if there is none.
+    The same word forms occur again and again, so results are cached.
+    """
+    readable = _scan_readable(anas, lemma, xpostag)
+    if readable is None:
+        readable = _parse_readable(anas, lemma, xpostag)
+    return readable
+
+
+_ANAS_START = '[{"lemma": '
+# the start of an analysis in the usual emtsv layout (without escapes)
+_ANAS_OBJECT_RE = re.compile(r'\{"lemma": "[^"]*", "tag": "')
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _scan_readable(anas, lemma, xpostag):
+    """
+    Find the selected analysis in the emtsv `anas` JSON by string search,
+    decoding only its `readable` value.
+    Return None if *anas* is not in the usual emtsv layout: each object
+    starts with its lemma and tag, and there are no escapes (so no '"'
+    within the strings).
+    """
+    if anas == '[]':
+        return False
+    if not anas.startswith(_ANAS_START) or '\\' in anas:
+        return None
+    # a '{"' within a string or in a nested object does not match
+    if len(_ANAS_OBJECT_RE.findall(anas)) != anas.count('{"'):
+        return None
+    head = '{"lemma": ' + json.dumps(lemma, ensure_ascii=False) +\
+           ', "tag": ' + json.dumps(xpostag, ensure_ascii=False)
+    start = anas.rfind(head)
+    if start == -1:
+        return False
+    end = anas.find(', {"lemma": ', start + len(head))
+    if end == -1:
+        end = len(anas)
+    key = anas.find(', "readable": ', start + len(head), end)
+    if key == -1:
+        return None
+    return _JSON_DECODER.raw_decode(anas, key + len(', "readable": '))[0]
+
+
+def _parse_readable(anas, lemma, xpostag):
+    """Same as _scan_readable(), by decoding the whole `anas` JSON."""
     last_good_ana = None
-    for ana in anas_list:
-        if ana["lemma"] == verb.lemma and ana["tag"] == verb.xpostag:
+    for ana in json.loads(anas):
+        if ana["lemma"] == lemma and ana["tag"] == xpostag:
             last_good_ana = ana
     if last_good_ana is None:
         return False
-    else:
-        return PREVERB_POSTAG in last_good_ana.get('readable')
+    return last_good_ana.get('readable')
+
 
 def is_eligible_preverb(word, distance=0):
     """
@@ -358,6 +772,19 @@ def is_eligible_preverb(word, distance=0):
     it has already been connected to a verb that is closer to it.
     """
     return (
-        word.xpostag == PREVERB_POSTAG
+        word.tags & PREVERB
         and (word.prev != "conn" or int(word.prevpos) >= distance)
     )
+
+
+@lru_cache(maxsize=None)
+def compiled_rules(tree):
+    """Return the function compiled from the decision tree *tree*."""
+    unknown = set(rule_names(tree)) - set(RULES + CASE_RULES)
+    if unknown:
+        raise ValueError('Rules not in stats.RULES or stats.CASE_RULES: '
+                         '{0}'.format(', '.join(sorted(unknown))))
+    return compile_rules(tree, ENV, {
+        'is_eligible_preverb': is_eligible_preverb,
+        'contains_preverb': contains_preverb,
+    })
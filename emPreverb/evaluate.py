@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Offline evaluation of EmPreverb against gold annotations.
+
+The gold files are emtsv files with the input fields of emPreverb and
+the gold `prev`, `previd` and (optionally) `prevpos` columns. They may
+also be in the output format of emPreverb (the `xpostag` of the
+annotated verbs starts with [/Prev], the lemma of a verb is joined with
+that of its preverb); the input of these tokens is restored before
+processing.
+The gold columns are removed, EmPreverb is run in-process on the
+sentences on a pool of worker processes, and its output is compared to
+the gold annotation sentence by sentence:
+- pfx: the tokens annotated `pfx`,
+- pairs: the (verb, preverb) token pairs connected by `sep` and `conn`
+  (with the same `previd` in the sentence),
+- prevpos: the tokens with their `prevpos` value.
+Precision, recall and F1 are computed for each, and the predictions are
+also broken down by the rule of the decision tree that made them.
+
+    python3 -m emPreverb.evaluate hungarian-preverb-corpus/ -j 8
+"""
+
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+from multiprocessing import Pool, cpu_count
+from time import perf_counter
+
+from .compressed import EXTENSIONS, open_input
+from .emPreverb import (PREVERB_POSTAG, SOURCE_FIELDS, TARGET_FIELDS,
+                        EmPreverb)
+from .stats import CASE_RULES, RULES
+from .tsv import make_field_names, read_header, read_sentences
+
+
+GOLD_FIELDS = {'prev', 'previd'} # `prevpos` is optional in the gold
+METRICS = ('pfx', 'pairs', 'prevpos')
+CHUNK_SIZE = 500 # sentences scored by a worker at a time
+GOLD_SUFFIXES = ('.tsv', '.out') # file names looked for in directories
+
+
+class Scores:
+    """True and false positive and false negative counts."""
+
+    def __init__(self):
+        # (metric, 'tp' | 'fp' | 'fn') and (metric, rule, 'tp' | 'fp')
+        self.counts = Counter()
+        self.metrics = set() # the metrics of the gold files
+        self.sentences = 0
+        self.tokens = 0
+
+    def add(self, metric, gold, predicted):
+        """
+        Count the items of a sentence.
+        :param gold: the set of gold items
+        :param predicted: dict of the predicted items -> rule
+        """
+        self.metrics.add(metric)
+        counts = self.counts
+        for item, rule in predicted.items():
+            result = 'tp' if item in gold else 'fp'
+            counts[metric, result] += 1
+            counts[metric, rule, result] += 1
+        counts[metric, 'fn'] += len(gold.difference(predicted))
+
+    def merge(self, other):
+        """Add the counts of *other* to these."""
+        self.counts.update(other.counts)
+        self.metrics.update(other.metrics)
+        self.sentences += other.sentences
+        self.tokens += other.tokens
+
+    def evaluated(self):
+        """:return: the evaluated metrics in the order of METRICS"""
+        return [metric for metric in METRICS if metric in self.metrics]
+
+    def scores(self, metric):
+        """:return: precision, recall and F1 of *metric*"""
+        tp, fp, fn = (self.counts[metric, result]
+                      for result in ('tp', 'fp', 'fn'))
+        return _prf(tp, tp + fp, tp + fn)
+
+    def as_dict(self):
+        """:return: the scores of each metric and rule"""
+        result = {'sentences': self.sentences, 'tokens': self.tokens}
+        for metric in self.evaluated():
+            precision, recall, f1 = self.scores(metric)
+            gold = self.counts[metric, 'tp'] + self.counts[metric, 'fn']
+            rules = {}
+            for rule in RULES + CASE_RULES:
+                tp = self.counts[metric, rule, 'tp']
+                predicted = tp + self.counts[metric, rule, 'fp']
+                if predicted:
+                    rules[rule] = {
+                        'predicted': predicted, 'correct': tp,
+                        'precision': tp / predicted,
+                        'recall_share': tp / gold if gold else 0.0}
+            result[metric] = {
+                'tp': self.counts[metric, 'tp'],
+                'fp': self.counts[metric, 'fp'],
+                'fn': self.counts[metric, 'fn'],
+                'precision': precision, 'recall': recall, 'f1': f1,
+                'rules': rules}
+        return result
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def summary(self):
+        """Return a human-readable summary."""
+        lines = ['{0} sentences, {1} tokens'.format(self.sentences,
+                                                     self.tokens)]
+        scores = self.as_dict()
+        for metric in self.evaluated():
+            values = scores[metric]
+            lines.append('{0:10}P {1:.4f}  R {2:.4f}  F1 {3:.4f}  '
+                         '(tp {4}, fp {5}, fn {6})'.format(
+                             metric, values['precision'], values['recall'],
+                             values['f1'], values['tp'], values['fp'],
+                             values['fn']))
+            lines.append('    {0:28}{1:>10}{2:>10}{3:>11}{4:>14}'.format(
+                'rule', 'predicted', 'correct', 'precision', 'recall share'))
+            for rule, counts in values['rules'].items():
+                lines.append('    {0:28}{1:>10}{2:>10}{3:>11.4f}{4:>14.4f}'
+                             .format(rule, counts['predicted'],
+                                     counts['correct'], counts['precision'],
+                                     counts['recall_share']))
+        return '\n'.join(lines) + '\n'
+
+
+def _prf(tp, predicted, gold):
+    precision = tp / predicted if predicted else 0.0
+    recall = tp / gold if gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) \
+        if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def annotation(sen, indices, rules=None):
+    """
+    Return the items of the annotation of a sentence, see METRICS.
+    :param indices: the indices of `prev`, `previd` and `prevpos` (None:
+                    no `prevpos`)
+    :param rules: dict of id(row) -> rule of the annotated tokens
+                  (default: rule None)
+    :return: dict of metric -> dict of item -> rule
+    """
+    prev_index, previd_index, prevpos_index = indices
+    items = {metric: {} for metric in METRICS}
+    preverbs = {tok[previd_index]: i for i, tok in enumerate(sen)
+                if tok[prev_index] == 'conn'}
+    for i, tok in enumerate(sen):
+        rule = rules.get(id(tok)) if rules is not None else None
+        if tok[prev_index] == 'pfx':
+            items['pfx'][i] = rule
+        elif tok[prev_index] == 'sep':
+            j = preverbs.get(tok[previd_index])
+            if j is None and prevpos_index is not None and \
+                    tok[prevpos_index]:
+                j = i + int(tok[prevpos_index])
+            if j is not None:
+                items['pairs'][i, j] = rule
+        if prevpos_index is not None and tok[prevpos_index] and \
+                tok[prev_index] != 'conn':
+            items['prevpos'][i, tok[prevpos_index]] = rule
+    return items
+
+
+def restore_input(sen, indices):
+    """
+    Restore the input of the tokens of a gold sentence in the output
+    format of emPreverb (see the module docstring) in place.
+    :param indices: the indices of `form`, `lemma`, `xpostag`, `prev` and
+                    `previd`
+    """
+    form_index, lemma_index, xpostag_index, prev_index, previd_index = indices
+    preverbs = {tok[previd_index]: tok for tok in sen
+                if tok[prev_index] == 'conn'}
+    for tok in sen:
+        prev = tok[prev_index]
+        if prev == 'conn' and not tok[lemma_index]:
+            tok[lemma_index] = tok[form_index].lower()
+        elif prev in ('sep', 'pfx') and \
+                tok[xpostag_index].startswith(PREVERB_POSTAG) and \
+                tok[xpostag_index] != PREVERB_POSTAG:
+            tok[xpostag_index] = tok[xpostag_index][len(PREVERB_POSTAG):]
+            preverb = preverbs.get(tok[previd_index])
+            if prev == 'sep' and preverb is not None:
+                prefix = preverb[form_index].lower()
+                if tok[lemma_index].startswith(prefix):
+                    tok[lemma_index] = tok[lemma_index][len(prefix):]
+
+
+def gold_files(paths):
+    """Return the gold files of *paths* (files or directories)."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+            for name in sorted(names):
+                base, extension = os.path.splitext(name)
+                if extension.lower() not in EXTENSIONS:
+                    base = name
+                if base.endswith(GOLD_SUFFIXES):
+                    files.append(os.path.join(root, name))
+    return files
+
+
+def gold_chunks(files, conll_comments=False, chunk_size=CHUNK_SIZE):
+    """
+    Read the gold sentences of *files*.
+    :return: iterator of (field names, sentences) chunks
+    """
+    for file_name in files:
+        with open(file_name, encoding='utf-8') as input_stream:
+            input_stream = open_input(input_stream)
+            fields, _ = read_header(input_stream,
+                                    SOURCE_FIELDS | GOLD_FIELDS, [])
+            chunk = []
+            for sen, _ in read_sentences(input_stream, conll_comments,
+                                         file_name=file_name,
+                                         columns=len(fields)):
+                chunk.append(sen)
+                if len(chunk) == chunk_size:
+                    yield fields, chunk
+                    chunk = []
+            if chunk:
+                yield fields, chunk
+
+
+_engine = None # the engine class of the worker process
+# (engine class, field names) -> (EmPreverb, Layout, rule log) in this
+# process
+_engines = {}
+
+
+def _init_worker(engine):
+    global _engine
+    _engine = engine
+
+
+def _em_preverb(fields):
+    """
+    Return the EmPreverb instance for the gold *fields* (the gold
+    columns replaced by its target fields at the end), its Layout and
+    its rule log, the dict of id(row) -> rule of the verbs it annotated.
+    """
+    config = _engine, fields
+    if config not in _engines:
+        rules = {}
+
+        class RuleLog(_engine):
+            def add_preverb(self, document, verb, prevpos, preverb=None,
+                            rule=None):
+                rules[id(verb.row)] = rule
+                super().add_preverb(document, verb, prevpos, preverb, rule)
+
+        em_preverb = RuleLog(source_fields=SOURCE_FIELDS,
+                             target_fields=TARGET_FIELDS)
+        names = [name for name in fields if name not in TARGET_FIELDS] + \
+            TARGET_FIELDS
+        layout = em_preverb.prepare_fields(make_field_names(names))
+        _engines[config] = em_preverb, layout, rules
+    return _engines[config]
+
+
+def score_chunk(chunk):
+    """
+    Score the sentences of a chunk of gold sentences.
+    :return: the Scores of the chunk
+    """
+    fields, sentences = chunk
+    fields = tuple(fields)
+    em_preverb, layout, rules = _em_preverb(fields)
+    gold_indices = [fields.index(name) if name in fields else None
+                    for name in TARGET_FIELDS]
+    metrics = [metric for metric in METRICS
+               if metric != 'prevpos' or 'prevpos' in fields]
+    restore_indices = [fields.index(name) for name in
+                       ('form', 'lemma', 'xpostag', 'prev', 'previd')]
+    input_indices = [i for i, name in enumerate(fields)
+                     if name not in TARGET_FIELDS]
+    output_indices = list(range(len(input_indices),
+                                len(input_indices) + len(TARGET_FIELDS)))
+
+    scores = Scores()
+    golds = []
+    inputs = []
+    for sen in sentences:
+        golds.append(annotation(sen, gold_indices))
+        restore_input(sen, restore_indices)
+        inputs.append([[tok[i] for i in input_indices] for tok in sen])
+    rules.clear()
+    document = em_preverb.new_document(layout)
+    for gold, sen in zip(golds, em_preverb.process_sentences(
+            inputs, layout, document)):
+        predicted = annotation(sen, output_indices, rules)
+        for metric in metrics:
+            scores.add(metric, set(gold[metric]), predicted[metric])
+        scores.sentences += 1
+        scores.tokens += len(sen)
+    rules.clear()
+    return scores
+
+
+def evaluate(files, jobs=1, engine=EmPreverb, conll_comments=False,
+             chunk_size=CHUNK_SIZE):
+    """
+    Evaluate *engine* on the gold *files* on *jobs* processes.
+    :return: the Scores
+    """
+    scores = Scores()
+    chunks = gold_chunks(files, conll_comments, chunk_size)
+    if jobs == 1:
+        _init_worker(engine)
+        for chunk in chunks:
+            scores.merge(score_chunk(chunk))
+        return scores
+    with Pool(jobs, _init_worker, (engine,)) as pool:
+        for chunk_scores in pool.imap_unordered(score_chunk, chunks):
+            scores.merge(chunk_scores)
+    return scores
+
+
+def main():
+    '''Main'''
+
+    argparser = ArgumentParser(
+        description='Evaluate emPreverb against gold annotations offline')
+    argparser.add_argument('gold', nargs='+',
+                           help='Gold emtsv files or directories (files '
+                                'ending with {0}, possibly compressed)'.format(
+                                    ' or '.join(GOLD_SUFFIXES)),
+                           metavar='PATH')
+    argparser.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+                           help='Number of worker processes (default: all '
+                                'cores)', metavar='N')
+    argparser.add_argument('--engine', choices=['reference', 'vectorised'],
+                           default='reference',
+                           help='Rule evaluation engine (default: reference)')
+    argparser.add_argument('--conllu-comments', action='store_true',
+                           help='Enable CoNLL-U style comments '
+                                '(lines starting with "# ")')
+    argparser.add_argument('--json', default=None,
+                           help='Save the scores as JSON to FILE',
+                           metavar='FILE')
+    opts = argparser.parse_args()
+
+    if opts.engine == 'vectorised':
+        from .vectorised import VectorisedEmPreverb as engine
+    else:
+        engine = EmPreverb
+
+    files = gold_files(opts.gold)
+    if not files:
+        argparser.error('No gold files found')
+    start = perf_counter()
+    scores = evaluate(files, opts.jobs, engine, opts.conllu_comments)
+    sys.stdout.write(scores.summary())
+    sys.stdout.write('{0} files evaluated in {1:.2f} s\n'.format(
+        len(files), perf_counter() - start))
+    if opts.json is not None:
+        with open(opts.json, 'w', encoding='utf-8') as json_file:
+            json_file.write(scores.to_json(indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
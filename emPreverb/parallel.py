@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Process an emtsv stream with a pool of EmPreverb worker processes.
+
+Sentences are independent of each other except for the `previd` counter.
+The input is sent to the workers in chunks of sentences, each chunk is
+numbered from 1 by its worker, and the results are written in input order
+with `previd` values shifted by the number of ids used by the preceding
+chunks, so the output is identical to that of a single process.
+"""
+
+from collections import deque
+from multiprocessing import Pool
+
+from .emPreverb import EmPreverb
+from .shards import ShardIds
+from .stats import RuleStats
+from .tsv import read_header, read_sentences, split_layout
+
+
+CHUNK_SIZE = 500 # sentences sent to a worker at a time
+
+_worker = None # the EmPreverb instance of the worker process
+
+
+def process_parallel(input_stream, output_stream, jobs, source_fields,
+                     target_fields, conll_comments=False,
+                     chunk_size=CHUNK_SIZE, stats=False, engine=EmPreverb,
+                     shard=None):
+    """
+    Read emtsv sentences from *input_stream*, process them on *jobs*
+    processes and write the output to *output_stream* in input order.
+    :param stats: collect rule statistics
+    :param engine: the EmPreverb class to use
+    :param shard: write shard-local `previd` values with this shard id
+                  (see shards.ShardIds)
+    :return: the rule statistics of all workers (a RuleStats) or None
+    """
+    file_name = getattr(input_stream, 'name', 'no filename for stream')
+    fields, output_fields = read_header(input_stream, source_fields,
+                                        target_fields)
+    output_stream.write('\t'.join(output_fields) + '\n')
+    maxsplit, field_names = split_layout(fields, source_fields | {'compound'},
+                                         target_fields)
+
+    prev_id = 0
+    all_stats = RuleStats() if stats else None
+    with Pool(jobs, _init_worker, (source_fields, target_fields, field_names,
+                                   maxsplit, len(fields), conll_comments,
+                                   stats, engine, shard)) as pool:
+        pending = deque()
+        for chunk in _line_chunks(input_stream, chunk_size, file_name,
+                                  conll_comments):
+            pending.append(pool.apply_async(_process_chunk, chunk))
+            if len(pending) >= 2 * jobs:
+                prev_id = _write_chunk(pending.popleft().get(), prev_id,
+                                       output_stream, all_stats)
+        while pending:
+            prev_id = _write_chunk(pending.popleft().get(), prev_id,
+                                   output_stream, all_stats)
+    return all_stats
+
+
+def _line_chunks(input_stream, chunk_size, file_name, conll_comments=False):
+    """
+    Split the lines of *input_stream* into chunks of *chunk_size* sentences
+    without parsing them.
+    :return: iterator of (lines, file name, line number before the chunk,
+             number of sentences before the chunk)
+    """
+    lines = []
+    sentences = 0
+    before = 0
+    start = 1 # the header
+    in_sentence = False
+    for line in input_stream:
+        lines.append(line)
+        if line == '\n':
+            if in_sentence:
+                in_sentence = False
+                sentences += 1
+                if sentences == chunk_size:
+                    yield lines, file_name, start, before
+                    start += len(lines)
+                    before += sentences
+                    lines = []
+                    sentences = 0
+        elif not in_sentence and not (conll_comments and
+                                      line.startswith('# ')):
+            in_sentence = True
+    if lines:
+        yield lines, file_name, start, before
+
+
+def _write_chunk(result, prev_id, output_stream, all_stats):
+    """
+    Write the output of a chunk, see _process_chunk().
+    :return: the last `previd` used so far
+    """
+    parts, used_ids, stats = result
+    if all_stats is not None:
+        all_stats.merge(stats)
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            output_stream.write(part)
+        else:
+            output_stream.write(str(part + prev_id))
+    return prev_id + used_ids
+
+
+def _init_worker(source_fields, target_fields, field_names, maxsplit,
+                 columns, conll_comments, stats, engine, shard):
+    global _worker
+    _worker = engine(source_fields=source_fields,
+                     target_fields=target_fields, stats=stats)
+    _worker.field_values = _worker.prepare_fields(field_names)
+    _worker.previd_index = field_names['previd']
+    _worker.maxsplit = maxsplit
+    _worker.columns = columns
+    _worker.conll_comments = conll_comments
+    _worker.shard = shard
+
+
+def _process_chunk(lines, file_name, line_number, sentences_before):
+    """
+    Process a chunk of input lines numbering `previd` from 1.
+    :return: the output text split at the `previd` values, which are
+             at the odd indices as ints (unless they are shard-local),
+             the number of ids used and the rule statistics of the chunk
+             (or None)
+    """
+    document = _worker.new_document(_worker.field_values)
+    previd_index = _worker.previd_index
+    parts = []
+    text = []
+    sentences = list(read_sentences(lines, _worker.conll_comments,
+                                    _worker.maxsplit, file_name, line_number,
+                                    _worker.columns))
+    processed = _worker.process_sentences((sen for sen, _ in sentences),
+                                          _worker.field_values, document)
+    if _worker.shard is not None:
+        processed = ShardIds(_worker.shard, previd_index,
+                             sentences_before).sentences(processed)
+    for (_, comment), sen in zip(sentences, processed):
+        text.append(comment)
+        for tok in sen:
+            previd = tok[previd_index]
+            if previd and _worker.shard is None:
+                text.append('\t'.join(tok[:previd_index + 1])[:-len(previd)])
+                parts.append(''.join(text))
+                parts.append(int(previd))
+                text = ['\t'.join(tok[previd_index:])[len(previd):], '\n']
+            else:
+                text.append('\t'.join(tok))
+                text.append('\n')
+        text.append('\n')
+    parts.append(''.join(text))
+    return parts, document.prev_id, document.stats
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Declarative specification of the EmPreverb decision tree and its
+compiler into a Python function.
+
+A decision tree is a sequence of Rules and Cases, tried in order:
+- Rule(name, condition, prevpos): if *condition* holds, the central token
+  is connected to the preverb at offset *prevpos* (None: it contains a
+  prefixed preverb, the `pfx` rule),
+- Case(condition, rules): if *condition* holds, *rules* are tried (and
+  no rule after the Case).
+The first rule whose condition holds is applied.
+
+Conditions refer to the tokens by their offset from the central token:
+- Tags(offset, mask): Word.tags has a bit of *mask*,
+- Morphs(offset, mask): Word.morphs has a bit of *mask*,
+- Eligible(offset, distance): is_eligible_preverb(),
+- ContainsPreverb(offset): contains_preverb(),
+- All(...), Any(...), Not(condition).
+
+compile_rules() generates the source of one function from a decision
+tree, in which the masks are constants, the conditions of a conjunction
+are ordered from the cheapest, the Tags (or Morphs) of the same token in
+a disjunction are merged into one test, and the first condition shared
+by consecutive rules is tested once.
+"""
+
+from collections import namedtuple
+
+
+Tags = namedtuple('Tags', ['offset', 'mask'])
+Morphs = namedtuple('Morphs', ['offset', 'mask'])
+Eligible = namedtuple('Eligible', ['offset', 'distance'])
+Eligible.__new__.__defaults__ = (0,)
+ContainsPreverb = namedtuple('ContainsPreverb', ['offset'])
+Not = namedtuple('Not', ['condition'])
+
+
+class All(tuple):
+    """Conjunction of conditions."""
+
+    def __new__(cls, *conditions):
+        return super().__new__(cls, conditions)
+
+    def __repr__(self):
+        return 'All{0}'.format(tuple.__repr__(self))
+
+
+class Any(tuple):
+    """Disjunction of conditions."""
+
+    def __new__(cls, *conditions):
+        return super().__new__(cls, conditions)
+
+    def __repr__(self):
+        return 'Any{0}'.format(tuple.__repr__(self))
+
+
+Rule = namedtuple('Rule', ['name', 'condition', 'prevpos'])
+Case = namedtuple('Case', ['condition', 'rules'])
+
+
+# relative cost of evaluating the conditions (Morphs parses `anas`
+# on first use, ContainsPreverb decodes the selected analysis)
+_COSTS = {Tags: 1, Eligible: 2, Morphs: 3, ContainsPreverb: 10}
+
+
+def compile_rules(tree, env, namespace, name='apply_rules'):
+    """
+    Compile the decision tree *tree* into a function
+    f(em_preverb, document, buf, i) that runs it on the token buf[i].
+    :param env: the largest offset the tokens may have
+    :param namespace: the globals of the function (is_eligible_preverb,
+                      contains_preverb)
+    :return: the function (with the generated source in its `source`)
+    """
+    _check(tree, env)
+    lines = ['def {0}(self, document, buf, i):'.format(name),
+             '    central = buf[i]',
+             '    tags = central.tags']
+    _compile_sequence(tree, lines, 1)
+    source = '\n'.join(lines) + '\n'
+    namespace = dict(namespace)
+    exec(compile(source, '<emPreverb rules>', 'exec'), namespace)
+    function = namespace[name]
+    function.source = source
+    return function
+
+
+def compile_condition(condition, env, namespace, name='condition'):
+    """
+    Compile *condition* into a function f(buf, i) that evaluates it on
+    the token buf[i].
+    :param env, namespace: see compile_rules()
+    :return: the function (with the generated source in its `source`)
+    """
+    _check_condition(condition, env)
+    source = '\n'.join([
+        'def {0}(buf, i):'.format(name),
+        '    central = buf[i]',
+        '    tags = central.tags',
+        '    return bool({0})'.format(_expr(_simplify(condition))),
+    ]) + '\n'
+    namespace = dict(namespace)
+    exec(compile(source, '<emPreverb condition>', 'exec'), namespace)
+    function = namespace[name]
+    function.source = source
+    return function
+
+
+def rule_names(tree):
+    """Return the names of the rules in *tree* in order."""
+    names = []
+    for node in tree:
+        if isinstance(node, Case):
+            names.extend(rule_names(node.rules))
+        else:
+            names.append(node.name)
+    return names
+
+
+def _check(tree, env):
+    for node in tree:
+        if isinstance(node, Case):
+            _check_condition(node.condition, env)
+            _check(node.rules, env)
+        else:
+            _check_condition(node.condition, env)
+            if node.prevpos is not None and abs(node.prevpos) > env:
+                raise ValueError('Rule {0}: prevpos {1} is out of the '
+                                 'environment'.format(node.name, node.prevpos))
+
+
+def _check_condition(condition, env):
+    if isinstance(condition, (All, Any)):
+        for part in condition:
+            _check_condition(part, env)
+    elif isinstance(condition, Not):
+        _check_condition(condition.condition, env)
+    elif abs(condition.offset) > env:
+        raise ValueError('Offset {0} of {1} is out of the environment'
+                         .format(condition.offset, condition))
+
+
+def _compile_sequence(tree, lines, depth):
+    """Compile the Rules and Cases of *tree*, sharing leading conditions."""
+    _compile_items([(_conjuncts(node.condition), node) for node in tree],
+                   lines, depth)
+
+
+def _compile_items(items, lines, depth):
+    indent = '    ' * depth
+    start = 0
+    while start < len(items):
+        conjuncts, node = items[start]
+        # consecutive items sharing the first condition
+        end = start + 1
+        if conjuncts:
+            first = _key(conjuncts[0])
+            while end < len(items) and items[end][0] and \
+                    _key(items[end][0][0]) == first:
+                end += 1
+        if end - start > 1:
+            lines.append('{0}if {1}:'.format(indent, _expr(conjuncts[0])))
+            _compile_items([(rest[1:], rest_node)
+                            for rest, rest_node in items[start:end]],
+                           lines, depth + 1)
+        else:
+            if conjuncts:
+                lines.append('{0}if {1}:'.format(
+                    indent, ' and '.join(_expr(part, True)
+                                         for part in conjuncts)))
+                body = indent + '    '
+            else:
+                body = indent
+            if isinstance(node, Case):
+                lines.append('{0}if document.stats is not None:'
+                             .format(body))
+                lines.append('{0}    document.stats.case_tokens += 1'
+                             .format(body))
+                _compile_sequence(node.rules, lines,
+                                  len(body) // 4)
+            else:
+                lines.append('{0}self.add_preverb(document, central, {1}, '
+                             '{2}, {3!r})'.format(
+                                 body, node.prevpos or 0,
+                                 _token(node.prevpos)
+                                 if node.prevpos is not None else None,
+                                 node.name))
+            lines.append('{0}return'.format(body))
+        start = end
+
+
+def _conjuncts(condition):
+    """Return the simplified conjuncts of *condition*, cheapest first."""
+    condition = _simplify(condition)
+    parts = list(condition) if isinstance(condition, All) else [condition]
+    # stable: a condition that guards a more expensive one stays before it
+    return sorted(parts, key=_cost)
+
+
+def _simplify(condition):
+    if isinstance(condition, (All, Any)):
+        parts = []
+        for part in map(_simplify, condition):
+            # flatten nested All(All()) and Any(Any())
+            if type(part) is type(condition):
+                parts.extend(part)
+            else:
+                parts.append(part)
+        if isinstance(condition, Any):
+            parts = _merge_masks(parts)
+        else:
+            parts = sorted(parts, key=_cost)
+        if len(parts) == 1:
+            return parts[0]
+        return type(condition)(*parts)
+    if isinstance(condition, Not):
+        return Not(_simplify(condition.condition))
+    return condition
+
+
+def _merge_masks(parts):
+    """
+    Merge the Tags (and the Morphs) of the same token in a disjunction
+    into one, and order the conditions from the cheapest.
+    """
+    masks = {}
+    rest = []
+    for part in parts:
+        if isinstance(part, (Tags, Morphs)):
+            key = type(part), part.offset
+            masks[key] = masks.get(key, 0) | part.mask
+        else:
+            rest.append(part)
+    merged = [kind(offset, mask) for (kind, offset), mask in masks.items()]
+    return sorted(merged + rest, key=_cost)
+
+
+def _key(condition):
+    """Return a comparable key of *condition* (namedtuples of different
+    types with the same values are equal as tuples)."""
+    if isinstance(condition, (All, Any, Not)):
+        return (type(condition).__name__,) + tuple(map(_key, condition))
+    return (type(condition).__name__,) + tuple(condition)
+
+
+def _cost(condition):
+    if isinstance(condition, (All, Any)):
+        return sum(map(_cost, condition))
+    if isinstance(condition, Not):
+        return _cost(condition.condition)
+    return _COSTS[type(condition)]
+
+
+def _token(offset):
+    if offset == 0:
+        return 'central'
+    return 'buf[i {0} {1}]'.format('-' if offset < 0 else '+', abs(offset))
+
+
+def _expr(condition, parenthesise=False):
+    if isinstance(condition, Tags):
+        if condition.offset == 0:
+            text = 'tags & {0:#x}'.format(condition.mask)
+        else:
+            text = '{0}.tags & {1:#x}'.format(_token(condition.offset),
+                                              condition.mask)
+    elif isinstance(condition, Morphs):
+        text = '{0}.morphs & {1:#x}'.format(_token(condition.offset),
+                                           condition.mask)
+    elif isinstance(condition, Eligible):
+        return 'is_eligible_preverb({0}, {1})'.format(
+            _token(condition.offset), condition.distance)
+    elif isinstance(condition, ContainsPreverb):
+        return 'contains_preverb({0})'.format(_token(condition.offset))
+    elif isinstance(condition, Not):
+        return 'not {0}'.format(_expr(condition.condition, True))
+    elif isinstance(condition, All):
+        text = ' and '.join(_expr(part, True) for part in condition)
+    else:
+        text = ' or '.join(_expr(part, True) for part in condition)
+    return '({0})'.format(text) if parenthesise else text
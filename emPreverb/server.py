@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Long-running EmPreverb service on localhost HTTP.
+
+POST an emtsv TSV document (header and sentences) to the server, the
+response is the output of emPreverb for the document, the same as that
+of `python -m emPreverb` (`previd` is numbered from 1 in each document).
+The compiled layout of each header is kept and reused by later requests,
+so a request costs only its processing time.
+See also emPreverb.client.
+"""
+
+import io
+import sys
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock
+
+from .emPreverb import SOURCE_FIELDS, TARGET_FIELDS, EmPreverb
+from .tsv import (HeaderError, format_sentence, read_header, read_sentences,
+                  split_layout)
+
+
+DEFAULT_PORT = 8797
+
+
+class EmPreverbPool:
+    """
+    One EmPreverb instance with the compiled layout of each header, shared
+    by the request threads. Each request is processed as a new Document,
+    so no lock is needed except when a new header is seen.
+    """
+
+    def __init__(self, conll_comments=False):
+        self.conll_comments = conll_comments
+        self.em_preverb = EmPreverb(source_fields=SOURCE_FIELDS,
+                                    target_fields=TARGET_FIELDS)
+        self._layouts = {} # header fields -> (maxsplit, Layout)
+        self._lock = Lock()
+
+    def process(self, lines):
+        """
+        Process a TSV document given as an iterator of lines.
+        :return: the output as a list of strings
+        """
+        fields, output_fields = read_header(lines, SOURCE_FIELDS,
+                                            TARGET_FIELDS)
+        maxsplit, layout = self._layout(tuple(fields))
+        document = self.em_preverb.new_document(layout)
+        output = ['\t'.join(output_fields) + '\n']
+        for sen, comment in read_sentences(lines, self.conll_comments,
+                                           maxsplit, columns=len(fields)):
+            output.append(format_sentence(self.em_preverb.process_sentence(
+                sen, layout, document), comment))
+        return output
+
+    def _layout(self, fields):
+        layout = self._layouts.get(fields)
+        if layout is None:
+            with self._lock:
+                maxsplit, field_names = split_layout(
+                    list(fields), SOURCE_FIELDS | {'compound'}, TARGET_FIELDS)
+                layout = maxsplit, self.em_preverb.prepare_fields(field_names)
+                layout = self._layouts.setdefault(fields, layout)
+        return layout
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class EmPreverbHandler(BaseHTTPRequestHandler):
+    """Process the TSV document in the body of each POST request."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            text = self.rfile.read(length).decode('utf-8')
+            # not str.splitlines(), which also splits at U+2028 etc.
+            output = self.server.pool.process(io.StringIO(text))
+        except (HeaderError, RuntimeError, ValueError) as e:
+            self._respond(400, str(e) + '\n')
+        else:
+            self._respond(200, ''.join(output))
+
+    def _respond(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/tab-separated-values; '
+                                         'charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(host='127.0.0.1', port=DEFAULT_PORT, conll_comments=False,
+          verbose=False):
+    """Run the server until interrupted."""
+    server = ThreadingHTTPServer((host, port), EmPreverbHandler)
+    server.pool = EmPreverbPool(conll_comments)
+    server.verbose = verbose
+    print('emPreverb server listening on http://{0}:{1}/'.format(
+        *server.server_address[:2]), file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    '''Main'''
+
+    argparser = ArgumentParser(
+        description='EmPreverb server - process emtsv TSV documents POSTed '
+                    'to localhost')
+    argparser.add_argument('--host', default='127.0.0.1',
+                           help='Address to listen on (default: 127.0.0.1)')
+    argparser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                           help='Port to listen on (default: {0})'.format(
+                               DEFAULT_PORT))
+    argparser.add_argument('--conllu-comments', action='store_true',
+                           help='Enable CoNLL-U style comments '
+                                '(lines starting with "# ")')
+    argparser.add_argument('--verbose', action='store_true',
+                           help='Log requests')
+    opts = argparser.parse_args()
+
+    serve(opts.host, opts.port, opts.conllu_comments, opts.verbose)
+
+
+if __name__ == '__main__':
+    main()
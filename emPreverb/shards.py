@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Shard-local `previd` values for distributed processing.
+
+By default, `previd` is a counter running across the whole input, so the
+ids of a shard of a corpus depend on the shards before it. With a shard
+id, `previd` is `SHARD.SENTENCE.K` instead, where SENTENCE is the number
+of the sentence in the shard and K is the number of the connection in
+the sentence, which depend only on the sentence, so shards processed
+independently (and in any way) can be concatenated without collisions.
+
+K is computed from the sequential ids of the processed sentences: the
+ids of a sentence follow the largest id of the sentences before it, and
+the largest id used in a sentence is never removed by clean_up() (only
+the verbs orphaned by a later connection lose their id), so merge()
+(python -m emPreverb.shards) can renumber concatenated shards into the
+same sequential ids as those of a single run.
+"""
+
+import sys
+from argparse import ArgumentParser, FileType
+
+from .compressed import open_input
+from .tsv import format_sentence, read_sentences
+
+
+def check_shard(shard):
+    """
+    Return *shard* if it is a valid shard id (not empty, without tabs
+    and newlines), raise ValueError otherwise.
+    """
+    if not shard or any(c in shard for c in '\t\n'):
+        raise ValueError('Invalid shard id: {0!r}'.format(shard))
+    return shard
+
+
+class ShardIds:
+    """Replace the sequential `previd` values of processed sentences."""
+
+    def __init__(self, shard, previd_index, sentence=0, prev_id=0):
+        """
+        :param shard: the id of the shard
+        :param previd_index: the index of `previd` in the rows
+        :param sentence: the number of the sentences before the first one
+        :param prev_id: the largest `previd` before the first sentence
+        """
+        self.shard = check_shard(shard)
+        self.previd_index = previd_index
+        self.sentence = sentence
+        self.prev_id = prev_id
+
+    def rows(self, rows):
+        """
+        Relabel the rows of the next sentence in place.
+        :return: iterator of the rows
+        """
+        self.sentence += 1
+        previd_index = self.previd_index
+        prefix = '{0}.{1}.'.format(self.shard, self.sentence)
+        base = top = self.prev_id
+        for row in rows:
+            previd = row[previd_index]
+            if previd:
+                previd = int(previd)
+                if previd > top:
+                    top = previd
+                row[previd_index] = prefix + str(previd - base)
+            yield row
+        self.prev_id = top
+
+    def sentences(self, sentences):
+        """
+        Relabel the rows of each sentence in place.
+        :return: iterator of the sentences
+        """
+        for sen in sentences:
+            for _ in self.rows(sen):
+                pass
+            yield sen
+
+
+def merge(input_streams, output_stream, conll_comments=False):
+    """
+    Concatenate processed shards (with the same header), renumbering
+    their shard-local `previd` values sequentially from 1.
+    """
+    header = None
+    prev_id = 0
+    for input_stream in input_streams:
+        file_name = getattr(input_stream, 'name', 'no filename for stream')
+        shard_header = next(input_stream, '')
+        if header is None:
+            header = shard_header
+            previd_index = header.rstrip('\n').split('\t').index('previd')
+            output_stream.write(header)
+        elif shard_header != header:
+            raise ValueError('The header of {0} differs from that of the '
+                             'first shard'.format(file_name))
+        for sen, comment in read_sentences(input_stream, conll_comments,
+                                           file_name=file_name):
+            top = prev_id
+            for tok in sen:
+                if tok[previd_index]:
+                    previd = prev_id + int(tok[previd_index].rsplit('.', 1)[1])
+                    top = max(top, previd)
+                    tok[previd_index] = str(previd)
+            prev_id = top
+            output_stream.write(format_sentence(sen, comment))
+
+
+def main():
+    '''Main'''
+
+    argparser = ArgumentParser(
+        description='Concatenate emPreverb outputs processed with --shard, '
+                    'renumbering previd sequentially')
+    argparser.add_argument('shards', nargs='+', type=FileType(),
+                           help='The outputs of the shards in order '
+                                '(may be compressed)', metavar='FILE')
+    argparser.add_argument('-o', '--output', dest='output_stream',
+                           type=FileType('w'), default=sys.stdout,
+                           help='Use output file instead of STDOUT',
+                           metavar='FILE')
+    argparser.add_argument('--conllu-comments', action='store_true',
+                           help='Enable CoNLL-U style comments '
+                                '(lines starting with "# ")')
+    opts = argparser.parse_args()
+
+    merge(map(open_input, opts.shards), opts.output_stream,
+          opts.conllu_comments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Statistics of the rules of the EmPreverb decision tree.
+Collected only if EmPreverb is created with stats=True.
+"""
+
+import json
+
+
+# The rules in the order they are tried.
+# The first rule whose conditions hold is applied to the central token.
+RULES = (
+    'pfx',                       # contains a prefixed preverb
+    'kell_comma_hogy',           # szét kell, hogy szedni
+    'kell_hogy',                 # szét kell hogy szedni
+    'participle_after_negation', # meg nem haladó, Kalivoda (2021: 69-73)
+    'nonfinite_left3',           # infinitive, adverbial participle
+    'nonfinite_left2',           # infinitive, adverbial participle
+)
+# Tried if none of RULES applied and the central token is a verb
+# or a verb-derivative that may have a separated preverb
+CASE_RULES = (
+    'case2_left2',               # szét kell szerelni, szét se szereli
+    'case3_right1',              # szereli szét
+    'case4_right2',              # rágja is szét, rágta volna szét
+    'right3',
+    'left1',
+)
+
+
+class RuleStats:
+    """Attempt and hit counts of the rules and processing time."""
+
+    def __init__(self):
+        self.sentences = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.hits = dict.fromkeys(RULES + CASE_RULES, 0)
+        self.case_tokens = 0 # tokens for which CASE_RULES were tried
+        self.orphans = 0 # `sep` verbs whose preverb was connected elsewhere
+
+    def add_sentence(self, tokens, seconds):
+        self.sentences += 1
+        self.tokens += tokens
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def merge(self, other):
+        """Add the counts of *other* to these."""
+        self.sentences += other.sentences
+        self.tokens += other.tokens
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        for rule, hits in other.hits.items():
+            self.hits[rule] += hits
+        self.case_tokens += other.case_tokens
+        self.orphans += other.orphans
+
+    def attempts(self):
+        """
+        Return the number of tokens for which each rule was tried,
+        computed from the hit counts of the rules before it.
+        """
+        attempts = {}
+        tried = self.tokens
+        for rule in RULES:
+            attempts[rule] = tried
+            tried -= self.hits[rule]
+        tried = self.case_tokens
+        for rule in CASE_RULES:
+            attempts[rule] = tried
+            tried -= self.hits[rule]
+        return attempts
+
+    def as_dict(self):
+        attempts = self.attempts()
+        return {
+            'sentences': self.sentences,
+            'tokens': self.tokens,
+            'seconds': self.seconds,
+            'mean_seconds_per_sentence':
+                self.seconds / self.sentences if self.sentences else 0.0,
+            'max_seconds_per_sentence': self.max_seconds,
+            'rules': {rule: {'attempts': attempts[rule],
+                             'hits': self.hits[rule]}
+                      for rule in RULES + CASE_RULES},
+            'case_tokens': self.case_tokens,
+            'orphans_removed': self.orphans,
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def summary(self):
+        """Return a human-readable summary."""
+        attempts = self.attempts()
+        lines = [
+            '{0} sentences, {1} tokens, {2:.3f} s ({3:.3f} ms/sentence, '
+            'max {4:.3f} ms)'.format(
+                self.sentences, self.tokens, self.seconds,
+                1000 * self.seconds / self.sentences if self.sentences else 0,
+                1000 * self.max_seconds),
+            '{0:28}{1:>12}{2:>10}'.format('rule', 'attempts', 'hits'),
+        ]
+        for rule in RULES + CASE_RULES:
+            lines.append('{0:28}{1:>12}{2:>10}'.format(
+                rule, attempts[rule], self.hits[rule]))
+        lines.append('orphaned sep verbs removed: {0}'.format(self.orphans))
+        return '\n'.join(lines) + '\n'
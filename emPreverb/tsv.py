@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Streaming reader and writer for the emtsv TSV format, to run EmPreverb
+without the xtsv pipeline.
+The output is the same as that of the xtsv pipeline.
+"""
+
+import logging
+from collections import deque
+
+from .cache import process_cached
+
+
+logger = logging.getLogger('emPreverb')
+
+REST_FIELD = '\t' # name of the unsplit rest of the line (not a valid name)
+WRITE_BATCH = 256 # sentences written at a time
+WRITE_LINES = 4096 # lines written at a time by process_windowed()
+
+
+class HeaderError(ValueError):
+    pass
+
+
+def read_header(input_stream, source_fields, target_fields):
+    """
+    Read the header of the emtsv input.
+    :return: the field names of the input and of the output
+    """
+    fields = next(input_stream, '').strip().split('\t')
+    if not source_fields.issubset(fields):
+        raise HeaderError(
+            'Input ({0}) does not have the required field names ({1}). '
+            'The following field names found: {2}'.format(
+                getattr(input_stream, 'name', 'no filename for stream'),
+                sorted(source_fields), fields))
+    return fields, fields + list(target_fields)
+
+
+def split_layout(fields, needed_fields, target_fields):
+    """
+    Find how far the lines need to be split to access *needed_fields*.
+    :return: maxsplit for str.split() and the dictionary of field names
+             of the split rows (in both directions, as in xtsv)
+    """
+    last = max(fields.index(name) for name in needed_fields
+               if name in fields)
+    if last + 1 < len(fields) - 1:
+        maxsplit = last + 1
+        names = fields[:maxsplit] + [REST_FIELD] + list(target_fields)
+    else:
+        maxsplit = -1
+        names = fields + list(target_fields)
+    return maxsplit, make_field_names(names)
+
+
+def make_field_names(names):
+    """
+    Return the dictionary of field names for prepare_fields() of the
+    rows with the fields *names* (in both directions, as in xtsv).
+    """
+    field_names = {name: i for i, name in enumerate(names)}
+    field_names.update({i: name for i, name in enumerate(names)})
+    return field_names
+
+
+def read_sentences(lines, conll_comments=False, maxsplit=-1,
+                   file_name='no filename for stream', line_number=1,
+                   columns=None):
+    """
+    Split *lines* (after the header) into sentences at blank lines.
+    :param columns: the number of fields in the header, checked on
+                    each line (None: not checked)
+    :return: iterator of (sentence, comment) pairs, where sentence is
+             the list of token rows and comment is the CoNLL-U style
+             comment before the sentence (or '')
+    """
+    sen = []
+    comment = ''
+    for line_number, line in enumerate(lines, line_number + 1):
+        line = line.rstrip('\n')
+        if not sen and conll_comments and line.startswith('# '):
+            comment += line + '\n'
+        elif not line:
+            if sen:
+                yield sen, comment
+                sen = []
+                comment = ''
+            else:
+                logger.warning('Wrong formatted sentences ({0}:{1}), only '
+                               'one blank line allowed!'.format(file_name,
+                                                                line_number))
+        else:
+            row = line.split('\t', maxsplit)
+            if columns is not None and len(row) != columns:
+                _check_row(row, columns, maxsplit, file_name, line_number)
+            sen.append(row)
+    if sen:
+        logger.warning('No blank line before EOF ({0})!'.format(file_name))
+        yield sen, comment
+
+
+def stream_sentences(lines, conll_comments=False, maxsplit=-1,
+                     file_name='no filename for stream', line_number=1,
+                     columns=None):
+    """
+    Split *lines* (after the header) into sentences as read_sentences(),
+    but without reading a whole sentence into memory.
+    :return: iterator of (rows, comment) pairs, where rows is the
+             iterator of the token rows of the sentence (the rows not
+             read before the next pair are skipped)
+    """
+    numbered = enumerate(lines, line_number + 1)
+    comment = ''
+    for line_number, line in numbered:
+        line = line.rstrip('\n')
+        if conll_comments and line.startswith('# '):
+            comment += line + '\n'
+        elif not line:
+            logger.warning('Wrong formatted sentences ({0}:{1}), only '
+                           'one blank line allowed!'.format(file_name,
+                                                            line_number))
+        else:
+            rows = _sentence_rows(line, line_number, numbered, maxsplit,
+                                  file_name, columns)
+            yield rows, comment
+            for _ in rows:
+                pass
+            comment = ''
+
+
+def _sentence_rows(first_line, line_number, numbered, maxsplit, file_name,
+                   columns):
+    row = first_line.split('\t', maxsplit)
+    if columns is not None and len(row) != columns:
+        _check_row(row, columns, maxsplit, file_name, line_number)
+    yield row
+    for line_number, line in numbered:
+        line = line.rstrip('\n')
+        if not line:
+            return
+        row = line.split('\t', maxsplit)
+        if columns is not None and len(row) != columns:
+            _check_row(row, columns, maxsplit, file_name, line_number)
+        yield row
+    logger.warning('No blank line before EOF ({0})!'.format(file_name))
+
+
+def _check_row(row, columns, maxsplit, file_name, line_number):
+    """
+    Check the number of fields of a *row* split with *maxsplit*, whose
+    last value is the unsplit rest of the line if it has more fields.
+    """
+    provided = len(row)
+    if provided == maxsplit + 1:
+        provided += row[-1].count('\t')
+    if provided != columns:
+        raise RuntimeError('In "{0}" at {1}: {2} values expected, {3} '
+                           'provided'.format(file_name, line_number, columns,
+                                             provided))
+
+
+def format_sentence(sen, comment=''):
+    """Return the TSV text of a processed sentence."""
+    return ''.join((comment,
+                    '\n'.join(['\t'.join(tok) for tok in sen]),
+                    '\n\n'))
+
+
+def process_stream(em_preverb, input_stream, output_stream,
+                   conll_comments=False, cache=None, delta=None, window=None,
+                   shard=None):
+    """
+    Run *em_preverb* on the emtsv *input_stream*.
+    :param cache: a cache.SentenceCache of sentence results to use
+    :param delta: a delta.DeltaWriter subclass to write only the changes
+                  with (to a binary *output_stream* for BinaryDeltaWriter)
+    :param window: process the sentences *window* tokens at a time with
+                   a bounded buffer (see EmPreverb.process_tokens()),
+                   so that very long sentences are not read into memory
+    :param shard: write shard-local `previd` values with this shard id
+                  (see shards.ShardIds)
+    """
+    fields, output_fields = read_header(input_stream,
+                                        em_preverb.source_fields,
+                                        em_preverb.target_fields)
+
+    maxsplit, field_names = split_layout(
+        fields, em_preverb.source_fields | {'compound'},
+        em_preverb.target_fields)
+    field_values = em_preverb.prepare_fields(field_names)
+    shard_ids = None
+    if shard is not None:
+        from .shards import ShardIds
+
+        shard_ids = ShardIds(shard, field_names['previd'],
+                             prev_id=em_preverb.prev_id)
+
+    if delta is not None:
+        process_delta(em_preverb, input_stream, conll_comments, maxsplit,
+                      field_names, field_values,
+                      delta(output_fields, field_names, output_stream), cache,
+                      shard_ids, len(fields))
+        return
+
+    output_stream.write('\t'.join(output_fields) + '\n')
+    if window is not None:
+        process_windowed(em_preverb, input_stream, output_stream,
+                         conll_comments, maxsplit, field_values, window,
+                         shard_ids, len(fields))
+        return
+
+    comments = deque()
+
+    def sentences():
+        for sen, comment in read_sentences(
+                input_stream, conll_comments, maxsplit,
+                getattr(input_stream, 'name', 'no filename for stream'),
+                columns=len(fields)):
+            comments.append(comment)
+            yield sen
+
+    processed = _process(em_preverb, sentences(), field_names, field_values,
+                         cache)
+    if shard_ids is not None:
+        processed = shard_ids.sentences(processed)
+    batch = []
+    for sen in processed:
+        batch.append(format_sentence(sen, comments.popleft()))
+        if len(batch) == WRITE_BATCH:
+            output_stream.write(''.join(batch))
+            batch = []
+    output_stream.write(''.join(batch))
+
+
+def process_windowed(em_preverb, input_stream, output_stream,
+                     conll_comments, maxsplit, field_values, window,
+                     shard_ids=None, columns=None):
+    """Run *em_preverb* on the sentences with a bounded buffer."""
+    lines = []
+    for rows, comment in stream_sentences(
+            input_stream, conll_comments, maxsplit,
+            getattr(input_stream, 'name', 'no filename for stream'),
+            columns=columns):
+        if comment:
+            lines.append(comment)
+        rows = em_preverb.process_tokens(rows, field_values, window=window)
+        if shard_ids is not None:
+            rows = shard_ids.rows(rows)
+        for row in rows:
+            lines.append('\t'.join(row) + '\n')
+            if len(lines) >= WRITE_LINES:
+                output_stream.write(''.join(lines))
+                lines = []
+        lines.append('\n')
+    output_stream.write(''.join(lines))
+
+
+def process_delta(em_preverb, input_stream, conll_comments, maxsplit,
+                  field_names, field_values, writer, cache=None,
+                  shard_ids=None, columns=None):
+    """Run *em_preverb* on the sentences, writing the changes with *writer*."""
+    originals = deque()
+
+    def sentences():
+        for sen, _ in read_sentences(
+                input_stream, conll_comments, maxsplit,
+                getattr(input_stream, 'name', 'no filename for stream'),
+                columns=columns):
+            originals.append(writer.originals(sen))
+            yield sen
+
+    processed = _process(em_preverb, sentences(), field_names, field_values,
+                         cache)
+    if shard_ids is not None:
+        processed = shard_ids.sentences(processed)
+    for sen_index, sen in enumerate(processed):
+        writer.add(sen_index, sen, originals.popleft())
+    writer.close()
+
+
+def _process(em_preverb, sentences, field_names, field_values, cache):
+    if cache is None:
+        return em_preverb.process_sentences(sentences, field_values)
+    return process_cached(em_preverb, sentences, field_names, cache)
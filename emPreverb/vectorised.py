@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+EmPreverb engine that evaluates the neighbour conditions of the rules
+on a batch of sentences at once with NumPy.
+Requires numpy (pip install emPreverb[numpy]).
+
+The batch is encoded into arrays of Word.tags, in which sentences are
+separated by ENV padding tokens (the sentence boundaries), and the
+condition of each node of the decision tree (self.rules) is evaluated
+on the whole batch by shifted comparisons of these arrays, as a pair of
+masks:
+- may: the condition may hold on the token (no rule applies elsewhere),
+- must: the condition surely holds on the token.
+Tags are known exactly, except that the tokens before the central token
+may have got a [/Prev] prefix in their `xpostag` (see add_preverb()),
+so there both their tags before and after that count.
+Morphs are tested by a substring search in `anas`, only on the tokens
+where they matter. The state-dependent part of Eligible ("already
+connected closer") and ContainsPreverb are left undecided.
+The candidate tokens, on which some rule may apply, are then resolved
+in order in Python, evaluating only the undecided conditions of the
+rules they may take, so the results and the `previd` numbering are the
+same as in the reference engine.
+Word objects are only created for the candidates and their neighbours.
+"""
+
+import os
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+from itertools import islice
+from time import perf_counter
+
+# no linear algebra here: the idle BLAS threads would only cost CPU time
+for _variable in ('OPENBLAS_NUM_THREADS', 'OMP_NUM_THREADS',
+                  'MKL_NUM_THREADS'):
+    os.environ.setdefault(_variable, '1')
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError('The vectorised engine of emPreverb requires numpy '
+                      '(pip install emPreverb[numpy])') from e
+
+from .emPreverb import (ANAS_MORPHEMES, ENV, FORM_TAGS,
+                        LEMMA_TAGS, PREVERB, PREVERB_POSTAG,
+                        XPOSTAG_CACHE_SIZE, XPOSTAG_TAGS, EmPreverb,
+                        contains_preverb, is_eligible_preverb, xpostag_tags)
+from .rules import (All, Any, Case, ContainsPreverb, Eligible, Morphs, Not,
+                    Tags, compile_condition)
+
+
+BATCH_SIZE = 1024 # sentences encoded at a time
+TAGS_MASK = (1 << 32) - 1 # Word.tags in the encoded tags
+
+# A node of the decision tree prepared for process_batch():
+# bit: its bit in the candidate bits of the tokens,
+# condition: its condition,
+# residual: the function of the conjuncts of the condition not decided
+#           by the masks (None: none),
+# rule: the Rule (None for a Case), steps: the Steps of a Case
+Step = namedtuple('Step', ['bit', 'condition', 'residual', 'rule', 'steps'])
+
+
+@lru_cache(maxsize=None)
+def compiled_steps(tree):
+    """Return the Steps of the decision tree *tree*."""
+    bits = iter(range(63))
+    namespace = {'is_eligible_preverb': is_eligible_preverb,
+                 'contains_preverb': contains_preverb}
+
+    def steps(nodes):
+        result = []
+        for node in nodes:
+            undecided = [part for part in _conjuncts(node.condition)
+                         if not _exact(part)]
+            residual = compile_condition(All(*undecided), ENV, namespace) \
+                if undecided else None
+            if isinstance(node, Case):
+                result.append(Step(1 << next(bits), node.condition,
+                                   residual, None, steps(node.rules)))
+            else:
+                result.append(Step(1 << next(bits), node.condition,
+                                   residual, node, None))
+        return tuple(result)
+
+    return steps(tree)
+
+
+def _conjuncts(condition):
+    return list(condition) if isinstance(condition, All) else [condition]
+
+
+def _exact(condition):
+    """Return whether the masks of *condition* are exact."""
+    if isinstance(condition, (All, Any)):
+        return all(map(_exact, condition))
+    if isinstance(condition, Not):
+        return _exact(condition.condition)
+    return isinstance(condition, Tags) and not _dynamic(condition)
+
+
+def _dynamic(condition):
+    """Return whether Tags *condition* may change before it is tested."""
+    return condition.offset < 0 and condition.mask & XPOSTAG_TAGS
+
+
+def _positive_morphs(condition, positive=True):
+    """Return the Morphs of *condition* not under an odd number of Nots."""
+    if isinstance(condition, Morphs):
+        return [condition] if positive else []
+    if isinstance(condition, Not):
+        return _positive_morphs(condition.condition, not positive)
+    if isinstance(condition, (All, Any)):
+        return [morphs for part in condition
+                for morphs in _positive_morphs(part, positive)]
+    return []
+
+
+@lru_cache(maxsize=XPOSTAG_CACHE_SIZE)
+def encoded_xpostag_tags(xpostag):
+    """
+    Return the Word.tags bits of *xpostag*, and in the bits above
+    TAGS_MASK, those of *xpostag* with a connected preverb.
+    """
+    return xpostag_tags(xpostag) | \
+        xpostag_tags(PREVERB_POSTAG + xpostag) << TAGS_MASK.bit_length()
+
+
+def _shift(array, offset):
+    """Return the array of array[i + offset] (False outside)."""
+    if offset == 0:
+        return array
+    result = np.zeros_like(array)
+    if offset > 0:
+        result[:-offset] = array[offset:]
+    else:
+        result[-offset:] = array[:offset]
+    return result
+
+
+class _Masks:
+    """The may and must masks of the conditions on a batch."""
+
+    def __init__(self, tags, connected_tags, rows, anas_index):
+        """
+        :param tags: the Word.tags of the tokens
+        :param connected_tags: their Word.tags with a connected preverb
+        """
+        self.tags = tags
+        self.connected_tags = connected_tags
+        self.rows = rows
+        self.anas_index = anas_index
+        self.true = np.ones(len(rows), dtype=bool)
+        self.false = np.zeros(len(rows), dtype=bool)
+        self.changeable = self.true # the tokens a rule may apply to
+        self.morphs = None # mask -> bool array (None: unknown)
+        self.cache = {}
+
+    def tags_mask(self, mask, connected=False):
+        key = mask, connected
+        if key not in self.cache:
+            tags = self.connected_tags if connected else self.tags
+            self.cache[key] = (tags & mask) != 0
+        return self.cache[key]
+
+    def bounds(self, condition, positive=True):
+        """
+        Return the (may, must) masks of *condition* at each central token.
+        :param positive: not under an odd number of Nots
+        """
+        if isinstance(condition, Tags):
+            value = self.tags_mask(condition.mask)
+            if not _dynamic(condition):
+                value = _shift(value, condition.offset)
+                return value, value
+            connected = self.tags_mask(condition.mask, True)
+            return (_shift(value | (self.changeable & connected),
+                           condition.offset),
+                    _shift(value & (~self.changeable | connected),
+                           condition.offset))
+        if isinstance(condition, Eligible):
+            return (self.bounds(Tags(condition.offset, PREVERB))[0],
+                    self.false)
+        if isinstance(condition, Morphs):
+            if positive and self.morphs is not None:
+                return (_shift(self.morphs[condition.mask], condition.offset),
+                        self.false)
+            return self.true, self.false
+        if isinstance(condition, ContainsPreverb):
+            return self.true, self.false
+        if isinstance(condition, Not):
+            may, must = self.bounds(condition.condition, not positive)
+            return ~must, ~may
+        parts = [self.bounds(part, positive) for part in condition]
+        may, must = parts[0]
+        if isinstance(condition, All):
+            for part_may, part_must in parts[1:]:
+                may = may & part_may
+                must = must & part_must
+        else:
+            for part_may, part_must in parts[1:]:
+                may = may | part_may
+                must = must | part_must
+        return may, must
+
+    def candidate_bits(self, steps, reach, stats):
+        """
+        Return the candidate bits of the tokens: the bit of a Step is set
+        where it is reached and its condition may hold.
+        :param reach: the mask of the tokens which reach the first Step
+        :param stats: Cases are also candidates where no rule of theirs
+                      may apply (to count the tokens which try them)
+        :return: the bits (an int64 array) and the masks of the bits of
+                 the Steps (bit -> bool array)
+        """
+        bits = np.zeros(len(reach), dtype=np.int64)
+        step_masks = {}
+        for step in steps:
+            may, must = self.bounds(step.condition)
+            here = reach & may
+            if step.steps is not None:
+                inner, inner_masks = self.candidate_bits(step.steps, here,
+                                                         stats)
+                step_masks.update(inner_masks)
+                bits |= inner
+                if not stats:
+                    here = inner != 0
+            step_masks[step.bit] = here
+            bits |= here.astype(np.int64) * step.bit
+            reach = reach & ~must
+        return bits, step_masks
+
+    def test_morphs(self, wanted):
+        """
+        Find the tokens which have a morpheme of each mask in `anas`,
+        among the tokens in *wanted* (mask -> bool array).
+        """
+        self.morphs = {}
+        rows = self.rows
+        anas_index = self.anas_index
+        for mask, positions in wanted.items():
+            morphemes = [morpheme for morpheme, bit in ANAS_MORPHEMES.items()
+                         if bit & mask]
+            indices = np.flatnonzero(positions).tolist()
+            anas = [rows[i][anas_index] for i in indices]
+            found = np.zeros(len(rows), dtype=bool)
+            if len(morphemes) == 1:
+                morpheme = morphemes[0]
+                found[indices] = [morpheme in value for value in anas]
+            else:
+                found[indices] = [any(morpheme in value
+                                      for morpheme in morphemes)
+                                  for value in anas]
+            self.morphs[mask] = found
+
+
+class VectorisedEmPreverb(EmPreverb):
+    """EmPreverb running the rules only on vectorially selected tokens."""
+
+    def process_sentence(self, sen, field_values=None, document=None):
+        """
+        Required by xtsv.
+        Process one sentence per function call.
+        :return: sen object augmented with output field values for each token
+        """
+        return self.process_batch([sen], self._document(field_values,
+                                                        document))[0]
+
+    def process_sentences(self, sentences, field_values=None, document=None):
+        """
+        Process an iterable of sentences in batches.
+        :return: iterator of the processed sentences (see process_sentence)
+        """
+        document = self._document(field_values, document)
+        sentences = iter(sentences)
+        while True:
+            batch = list(islice(sentences, BATCH_SIZE))
+            if not batch:
+                break
+            yield from self.process_batch(batch, document)
+
+    def process_batch(self, batch, document=None):
+        """
+        Process a list of sentences.
+        :param document: see EmPreverb.process_sentence()
+        :return: the list of processed sentences
+        """
+        start = perf_counter()
+        if document is None:
+            document = self.document
+        layout = document.layout
+        word_class = layout.word_class
+        features = word_class.features
+        form_index = features.index('form')
+        lemma_index = features.index('lemma')
+        xpostag_index = features.index('xpostag')
+        padding = layout.padding[0]
+        empty_targets = [''] * layout.target_count
+        form_tags = FORM_TAGS.get
+        lemma_tags = LEMMA_TAGS.get
+
+        # [padding] sen1 [padding] sen2 ... [padding]
+        rows = [None] * ENV
+        encoded = [padding.tags] * ENV
+        starts = []
+        for sen in batch:
+            starts.append(len(rows))
+            for row in sen:
+                row.extend(empty_targets)
+                if len(row) != len(features):
+                    word_class(row) # raises the error of a wrong row
+            encoded.extend([encoded_xpostag_tags(row[xpostag_index]) |
+                            form_tags(row[form_index], 0) |
+                            lemma_tags(row[lemma_index], 0) for row in sen])
+            rows.extend(sen)
+            rows.extend([None] * ENV)
+            encoded.extend([padding.tags] * ENV)
+        encoded = np.array(encoded, dtype=np.int64)
+        tags = encoded & TAGS_MASK
+        connected_tags = (tags & ~XPOSTAG_TAGS) | \
+            (encoded >> TAGS_MASK.bit_length())
+        in_sentence = np.zeros(len(rows), dtype=bool)
+        for sen, sen_start in zip(batch, starts):
+            in_sentence[sen_start:sen_start + len(sen)] = True
+
+        # first pass: the tokens a rule may apply to, and those whose
+        # Morphs matter (the neighbours of the tokens on which a Step may
+        # apply if the Morphs hold)
+        steps = compiled_steps(self.rules)
+        stats = document.stats is not None
+        masks = _Masks(tags, connected_tags, rows, features.index('anas'))
+        _, step_masks = masks.candidate_bits(steps, in_sentence, stats)
+        changeable = masks.false
+        wanted = {}
+        for step in _all_steps(steps):
+            if step.steps is None:
+                changeable = changeable | step_masks[step.bit]
+            for morphs in _positive_morphs(step.condition):
+                positions = _shift(step_masks[step.bit], -morphs.offset)
+                if morphs.mask in wanted:
+                    positions = positions | wanted[morphs.mask]
+                wanted[morphs.mask] = positions
+        masks.test_morphs(wanted)
+        masks.changeable = changeable
+        bits, _ = masks.candidate_bits(steps, in_sentence, stats)
+
+        candidates = np.flatnonzero(bits)
+        buffer = [padding] * len(rows)
+        if len(candidates):
+            near = np.zeros(len(rows), dtype=bool)
+            near[candidates] = True
+            for distance in range(1, ENV + 1):
+                near[distance:] |= near[:-distance].copy()
+            for distance in range(1, ENV + 1):
+                near[:-distance] |= near[distance:].copy()
+            near = np.flatnonzero(near & in_sentence)
+            for i, word_tags in zip(near.tolist(), tags[near].tolist()):
+                buffer[i] = word_class.from_tags(rows[i], word_tags)
+
+            candidates = candidates.tolist()
+            for i, token_bits in zip(candidates, bits[candidates].tolist()):
+                self.resolve(document, buffer, i, token_bits, steps)
+
+            for sen, sen_start in zip(batch, starts):
+                first = bisect_left(candidates, sen_start)
+                if first < len(candidates) and \
+                        candidates[first] < sen_start + len(sen):
+                    self.clean_up(document, buffer, sen_start,
+                                  sen_start + len(sen))
+
+        if stats:
+            # the time of the batch is divided among its sentences
+            seconds = (perf_counter() - start) / len(batch)
+            for sen in batch:
+                document.stats.add_sentence(len(sen), seconds)
+        return batch
+
+    def resolve(self, document, buf, i, bits, steps):
+        """
+        Run the Steps whose bits are set in *bits* on the token buf[i],
+        as the decision tree would be run on it.
+        """
+        for step in steps:
+            if bits & step.bit and (step.residual is None or
+                                    step.residual(buf, i)):
+                if step.steps is not None:
+                    if document.stats is not None:
+                        document.stats.case_tokens += 1
+                    self.resolve(document, buf, i, bits, step.steps)
+                else:
+                    prevpos = step.rule.prevpos
+                    self.add_preverb(document, buf[i], prevpos or 0,
+                                     buf[i + prevpos]
+                                     if prevpos is not None else None,
+                                     step.rule.name)
+                return
+
+
+def _all_steps(steps):
+    for step in steps:
+        yield step
+        if step.steps is not None:
+            yield from _all_steps(step.steps)
@@ -35,14 +35,16 @@ setuptools.setup(
         'License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)',
         'Operating System :: POSIX :: Linux',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=['xtsv>=1.0.0,<2.0.0',
-                      'more-itertools',
                       ],
+    extras_require={'numpy': ['numpy'], 'zstd': ['zstandard']},
     include_package_data=True,
     entry_points={
         'console_scripts': [
             'emPreverb=emPreverb.__main__:main',
+            'emPreverb-server=emPreverb.server:main',
+            'emPreverb-client=emPreverb.client:main',
         ]
     },
 )
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Check AsyncEmPreverb (emPreverb.aio) against the golden files: process
+each input with several small batches at a time, so that the `previd`
+values of the batches are renumbered, and compare the output with the
+expected one. Also check that the batches not yet started are cancelled
+when the iteration is stopped.
+"""
+
+import asyncio
+import os
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from threading import Event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from emPreverb.aio import AsyncEmPreverb  # noqa: E402
+from emPreverb.emPreverb import (SOURCE_FIELDS, TARGET_FIELDS,  # noqa: E402
+                                 EmPreverb)
+from emPreverb.tsv import (format_sentence, read_header,  # noqa: E402
+                           read_sentences)
+
+
+def read_document(path):
+    """:return: the field names and the sentences of *path*"""
+    with open(path, encoding='utf-8') as fh:
+        fields, _ = read_header(fh, SOURCE_FIELDS, TARGET_FIELDS)
+        return fields, [sen for sen, _ in read_sentences(
+            fh, file_name=path, columns=len(fields))]
+
+
+async def _sentences(sentences):
+    # an async iterable with a context switch between the sentences
+    for sen in sentences:
+        await asyncio.sleep(0)
+        yield sen
+
+
+async def round_trip(path, concurrency, batch_size):
+    """:return: the output of AsyncEmPreverb for the input file *path*"""
+    fields, sentences = read_document(path)
+    aio_preverb = AsyncEmPreverb(fields, concurrency=concurrency,
+                                 batch_size=batch_size)
+    try:
+        processed = await aio_preverb.process_document(_sentences(sentences))
+    finally:
+        aio_preverb.close()
+    return ''.join(['\t'.join(fields + TARGET_FIELDS) + '\n'] +
+                   [format_sentence(sen) for sen in processed])
+
+
+class CountingEmPreverb(EmPreverb):
+    """EmPreverb which counts the batches started."""
+
+    batches = 0
+
+    def process_sentences(self, sentences, field_values=None, document=None):
+        CountingEmPreverb.batches += 1
+        return super().process_sentences(sentences, field_values, document)
+
+
+async def cancellation(path):
+    """
+    Cancel the processing of a document while its batches are waiting
+    in the executor (its only thread is kept busy until then).
+    :return: the number of batches started (0 if they were cancelled)
+    """
+    fields, sentences = read_document(path)
+    executor = ThreadPoolExecutor(1)
+    gate = Event()
+    executor.submit(gate.wait)
+    aio_preverb = AsyncEmPreverb(fields, engine=CountingEmPreverb,
+                                 concurrency=3, executor=executor,
+                                 batch_size=1)
+    task = asyncio.ensure_future(aio_preverb.process_document(sentences))
+    # the task submits the batches and waits for the first one
+    await asyncio.sleep(0)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    # the cancellation reaches the executor in a callback of the loop
+    await asyncio.sleep(0)
+    gate.set()
+    executor.shutdown(wait=True)
+    return CountingEmPreverb.batches
+
+
+def main():
+    argparser = ArgumentParser(description=__doc__)
+    argparser.add_argument('-i', '--inputs', nargs='+',
+                           default=sorted(glob(os.path.join(
+                               ROOT, 'tests', 'inputs', '*.in'))),
+                           help='Input files (default: tests/inputs/*.in), '
+                                'compared with the files of the same name '
+                                'in tests/outputs')
+    argparser.add_argument('-c', '--concurrency', type=int, default=4,
+                           help='Batches processed at a time '
+                                '(default: %(default)s)')
+    argparser.add_argument('-b', '--batch-size', type=int, default=3,
+                           help='Sentences in a batch (default: %(default)s)')
+    opts = argparser.parse_args()
+
+    failures = 0
+    for path in opts.inputs:
+        name = os.path.splitext(os.path.basename(path))[0]
+        expected_path = os.path.join(ROOT, 'tests', 'outputs', name + '.out')
+        with open(expected_path, encoding='utf-8') as fh:
+            expected = fh.read()
+        output = asyncio.run(round_trip(path, opts.concurrency,
+                                        opts.batch_size))
+        if output == expected:
+            print('{0}: identical to {1}'.format(path, expected_path))
+        else:
+            print('{0}: differs from {1}'.format(path, expected_path))
+            failures += 1
+
+    batches = asyncio.run(cancellation(opts.inputs[0]))
+    if batches == 0:
+        print('Cancellation: the batches not yet started were cancelled')
+    else:
+        print('Cancellation: {0} batches started after the cancellation'
+              .format(batches))
+        failures += 1
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
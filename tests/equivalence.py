@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Differential equivalence harness: run the EmPreverb of before the
+optimisations (a frozen copy in tests/baseline_emPreverb.py, sentence by
+sentence) and a candidate engine (also the current reference engine)
+side by side, in-process, on
+- the test inputs (tests/inputs/*.in),
+- shuffled versions of them (random column and sentence order),
+- random documents built from the tags, word forms and morphemes the
+  rules use,
+- template documents, in which the tokens around each central token are
+  chosen to satisfy the condition of a rule of the decision tree (so each
+  rule and each branch of clean_up() is taken),
+spread over all cores, and report the first sentence on which their
+output differs, with a minimised reproducer: the smallest document found
+(by removing sentences and tokens) on which they still differ.
+--self-test checks that the template documents take all rules and
+branches, and that a candidate without any one of the rules differs.
+"""
+
+import json
+import os
+import random
+import sys
+from argparse import ArgumentParser
+from glob import glob
+from importlib import import_module
+from multiprocessing import Pool, cpu_count
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from emPreverb.emPreverb import (ENV, PREVERB, SOURCE_FIELDS,  # noqa: E402
+                                 TARGET_FIELDS, EmPreverb, contains_preverb,
+                                 is_eligible_preverb)
+from emPreverb.rules import (All, Any, Case, ContainsPreverb,  # noqa: E402
+                             Eligible, Morphs, Not, Tags, compile_condition,
+                             rule_names)
+from emPreverb.tsv import (make_field_names, read_header,  # noqa: E402
+                           read_sentences)
+
+from baseline_emPreverb import EmPreverb as BaselineEmPreverb  # noqa: E402
+
+ENGINES = {
+    'reference': 'emPreverb.emPreverb:EmPreverb',
+    'vectorised': 'emPreverb.vectorised:VectorisedEmPreverb',
+}
+MODES = ('sentence', 'sentences', 'tokens')
+
+# form, lemma, xpostag and the `readable` of the selected analysis
+# of the tokens of the random documents
+VOCABULARY = (
+    ('meg', 'meg', '[/Prev]', 'meg[/Prev]'),
+    ('szét', 'szét', '[/Prev]', 'szét[/Prev]'),
+    ('el', 'el', '[/Prev]', 'el[/Prev]'),
+    ('szereli', 'szerel', '[/V][Prs.Def.3Sg]', 'szerel[/V] + i[Prs.Def.3Sg]'),
+    ('megszereli', 'megszerel', '[/V][Prs.Def.3Sg]',
+     'meg[/Prev] + szerel[/V] + i[Prs.Def.3Sg]'),
+    ('szerelni', 'szerel', '[/V][Inf]', 'szerel[/V] + ni[Inf]'),
+    ('megszerelni', 'megszerel', '[/V][Inf]',
+     'meg[/Prev] + szerel[/V] + ni[Inf]'),
+    ('szerelve', 'szerel', '[/Adv]', 'szerel[/V] + ve[_AdvPtcp/Adv]'),
+    ('szerelve', 'szerel', '[/V][_AdvPtcp/Adv]',
+     'szerel[/V] + ve[_AdvPtcp/Adv]'),
+    ('szerelhető', 'szerelhető', '[/Adj][Nom]',
+     'szerel[/V] + hető[_ModPtcp/Adj] + [Nom]'),
+    ('szerelt', 'szerelt', '[/Adj][Nom]',
+     'szerel[/V] + t[_PerfPtcp/Adj] + [Nom]'),
+    ('szerelő', 'szerelő', '[/Adj][Nom]',
+     'szerel[/V] + ő[_ImpfPtcp/Adj] + [Nom]'),
+    ('szerelendő', 'szerelendő', '[/Adj][Nom]',
+     'szerel[/V] + endő[_FutPtcp/Adj] + [Nom]'),
+    ('szerelés', 'szerelés', '[/N][Nom]',
+     'szerel[/V] + és[_Ger/N] + [Nom]'),
+    ('megszerelés', 'megszerelés', '[/N][Nom]',
+     'meg[/Prev] + szerel[/V] + és[_Ger/N] + [Nom]'),
+    ('legmegfelelőbb', 'megfelelő', '[/Supl][/Adj][Nom]',
+     'leg[/Supl] + meg[/Prev] + felel[/V] + ő[_ImpfPtcp/Adj] + bb[_Comp/Adj]'
+     ' + [Nom]'),
+    ('szerelhetően', 'szerelhető', '[/Adj][_Manner/Adv]',
+     'szerel[/V] + hető[_ModPtcp/Adj] + en[_Manner/Adv]'),
+    ('kell', 'kell', '[/V][Prs.NDef.3Sg]', 'kell[/V] + [Prs.NDef.3Sg]'),
+    ('hogy', 'hogy', '[/Cnj]', 'hogy[/Cnj]'),
+    (',', ',', '[Punct]', ''),
+    ('volna', 'van', '[/V][Cond.NDef.3Sg]', 'van[/V] + na[Cond.NDef.3Sg]'),
+    ('van', 'van', '[/V][Prs.NDef.3Sg]', 'van[/V] + [Prs.NDef.3Sg]'),
+    ('lesz', 'lesz', '[/V][Prs.NDef.3Sg]', 'lesz[/V] + [Prs.NDef.3Sg]'),
+    ('nem', 'nem', '[/Adv]', 'nem[/Adv]'),
+    ('se', 'se', '[/Adv]', 'se[/Adv]'),
+    ('is', 'is', '[/Cnj]', 'is[/Cnj]'),
+    ('ám', 'ám', '[/Cnj]', 'ám[/Cnj]'),
+    ('hirtelen', 'hirtelen', '[/Adv]', 'hirtelen[/Adv]'),
+    ('ott', 'ott', '[/Adv|Pro]', 'ott[/Adv|Pro]'),
+    ('a', 'a', '[/Det|Art.Def]', 'a[/Det|Art.Def]'),
+    ('egy', 'egy', '[/Det|Art.NDef]', 'egy[/Det|Art.NDef]'),
+    ('ez', 'ez', '[/Det|Pro][Nom]', 'ez[/Det|Pro] + [Nom]'),
+    ('ő', 'ő', '[/N|Pro][3Sg][Nom]', 'ő[/N|Pro][3Sg] + [Nom]'),
+    ('vajon', 'vajon', '[/QPtcl]', 'vajon[/QPtcl]'),
+    ('ház', 'ház', '[/N][Nom]', 'ház[/N] + [Nom]'),
+    ('szép', 'szép', '[/Adj][Nom]', 'szép[/Adj] + [Nom]'),
+)
+# `readable` of the other analyses, which only the morpheme search sees
+DISTRACTORS = (
+    'meg[/Cnj]', 'szerel[/V] + ve[_AdvPtcp/Adv]', 'meg[/Prev] + ad[/V]',
+    'ad[/V] + ható[_ModPtcp/Adj]', 'ad[/V] + ás[_Ger/N]', 'ház[/N]',
+)
+
+
+def load_engine(name):
+    """Return the EmPreverb class *name* (see ENGINES, or module:Class)."""
+    module, _, cls = ENGINES.get(name, name).partition(':')
+    return getattr(import_module(module), cls)
+
+
+def read_document(path):
+    """:return: the field names and the sentences (lists of rows)"""
+    with open(path, encoding='utf-8') as fh:
+        fields, _ = read_header(fh, SOURCE_FIELDS, TARGET_FIELDS)
+        return fields, [sen for sen, _ in read_sentences(fh)]
+
+
+def shuffled_document(path, seed):
+    """Return the document *path* with its columns and sentences shuffled."""
+    fields, sentences = read_document(path)
+    rnd = random.Random(seed)
+    order = list(range(len(fields)))
+    rnd.shuffle(order)
+    rnd.shuffle(sentences)
+    return ([fields[i] for i in order],
+            [[[tok[i] for i in order] for tok in sen] for sen in sentences])
+
+
+def random_fields(rnd):
+    """Return the field names of a random document."""
+    fields = ['form', 'wsafter', 'anas', 'lemma', 'xpostag']
+    if rnd.random() < 0.5:
+        fields.append('compound')
+    rnd.shuffle(fields)
+    return fields
+
+
+def random_document(seed, max_sentences=20, max_length=30):
+    """Return a random document of tokens of VOCABULARY."""
+    rnd = random.Random(seed)
+    fields = random_fields(rnd)
+    sentences = []
+    for _ in range(rnd.randint(1, max_sentences)):
+        sentences.append([random_row(rnd, fields, rnd.choice(VOCABULARY))
+                          for _ in range(rnd.randint(1, max_length))])
+    return fields, sentences
+
+
+def random_row(rnd, fields, entry, anas=None):
+    """Return the row of the VOCABULARY *entry* (with a random `anas`)."""
+    form, lemma, xpostag, readable = entry
+    if anas is None:
+        anas = random_anas(rnd, lemma, xpostag, readable)
+    values = {'form': form, 'wsafter': '" "', 'anas': anas,
+              'lemma': lemma, 'xpostag': xpostag, 'compound': '?'}
+    return [values[name] for name in fields]
+
+
+def random_anas(rnd, lemma, xpostag, readable):
+    """
+    Return an emtsv `anas` JSON with the analysis (or a variant), written
+    in the usual emtsv layout or in another valid one.
+    """
+    choice = rnd.random()
+    if choice < 0.05:
+        return '[]'
+    anas = [{'lemma': lemma, 'tag': xpostag, 'readable': readable}]
+    if choice < 0.1: # no analysis with the selected lemma
+        anas[0]['lemma'] += 'x'
+    if rnd.random() < 0.3:
+        anas.insert(rnd.randint(0, 1), {'lemma': lemma, 'tag': '[/X]',
+                                        'readable': rnd.choice(DISTRACTORS)})
+    if rnd.random() < 0.15: # keys in another order
+        anas = [dict(rnd.sample(list(ana.items()), len(ana)))
+                for ana in anas]
+    separators = (',', ':') if rnd.random() < 0.1 else None
+    # \u escapes are decoded differently from the usual layout
+    text = json.dumps(anas, ensure_ascii=rnd.random() < 0.1,
+                      separators=separators)
+    if rnd.random() < 0.1:
+        text = text.replace('/', '\\/')
+    return text
+
+
+def rule_conditions(tree, cases=()):
+    """
+    Return the (name, condition) of the Rules of the decision tree *tree*,
+    with the conditions of the Cases leading to them.
+    """
+    result = []
+    for node in tree:
+        if isinstance(node, Case):
+            result += rule_conditions(node.rules, cases + (node.condition,))
+        else:
+            result.append((node.name, All(*cases, node.condition)))
+    return result
+
+
+def literals(rnd, condition, positive=True):
+    """
+    Return a random list of (leaf condition, positive) that implies
+    *condition* (or its negation).
+    """
+    if isinstance(condition, Not):
+        return literals(rnd, condition.condition, not positive)
+    if isinstance(condition, (All, Any)):
+        if isinstance(condition, All) == positive:
+            return [literal for part in condition
+                    for literal in literals(rnd, part, positive)]
+        return literals(rnd, rnd.choice(condition), positive)
+    return [(condition, positive)]
+
+
+def satisfies(word, leaf, positive):
+    """Return whether the leaf condition holds on *word* as *positive*."""
+    if isinstance(leaf, Tags):
+        value = word.tags & leaf.mask
+    elif isinstance(leaf, Morphs):
+        value = word.morphs & leaf.mask
+    elif isinstance(leaf, Eligible):
+        value = word.tags & PREVERB
+    else:
+        value = contains_preverb(word)
+    return bool(value) == positive
+
+
+class Templates:
+    """Sentences on which the rules of a decision tree may be taken."""
+
+    def __init__(self, fields, tree=EmPreverb.rules):
+        self.fields = fields
+        self.layout = EmPreverb(
+            source_fields=set(SOURCE_FIELDS),
+            target_fields=list(TARGET_FIELDS)).prepare_fields(
+                field_names(fields))
+        namespace = {'is_eligible_preverb': is_eligible_preverb,
+                     'contains_preverb': contains_preverb}
+        self.rules = [(name, condition,
+                       compile_condition(condition, ENV, namespace))
+                      for name, condition in rule_conditions(tree)]
+        # the Word of each entry with its analysis in the usual layout
+        self.words = [(entry, self.word(random_row(None, fields, entry,
+                                                   _anas(entry))))
+                      for entry in VOCABULARY]
+
+    def word(self, row):
+        return self.layout.word_class(row + [''] * len(TARGET_FIELDS))
+
+    def window(self, rnd, rule, attempts=100):
+        """
+        Return 2 * ENV + 1 rows on which the condition of *rule* holds at
+        the central token (or None if none was found).
+        """
+        _, condition, test = rule
+        for _ in range(attempts):
+            wanted = {}
+            for leaf, positive in literals(rnd, condition):
+                wanted.setdefault(leaf.offset, []).append((leaf, positive))
+            rows = []
+            for offset in range(-ENV, ENV + 1):
+                entries = [entry for entry, word in self.words
+                           if all(satisfies(word, *literal)
+                                  for literal in wanted.get(offset, ()))]
+                if not entries:
+                    break
+                rows.append(random_row(rnd, self.fields, rnd.choice(entries)))
+            else:
+                if test([self.word(row) for row in rows], ENV):
+                    return rows
+        return None
+
+
+def _anas(entry):
+    _, lemma, xpostag, readable = entry
+    return json.dumps([{'lemma': lemma, 'tag': xpostag,
+                        'readable': readable}], ensure_ascii=False)
+
+
+def template_document(seed, max_sentences=8, max_windows=3):
+    """
+    Return a random document of sentences made of the windows of random
+    rules (see Templates), which may overlap.
+    """
+    rnd = random.Random(seed)
+    fields = random_fields(rnd)
+    templates = Templates(fields)
+    sentences = []
+    for _ in range(rnd.randint(1, max_sentences)):
+        sen = []
+        for _ in range(rnd.randint(1, max_windows)):
+            window = templates.window(rnd, rnd.choice(templates.rules))
+            if window is not None:
+                # overlapping windows connect a preverb twice (orphans)
+                overlap = min(len(sen), rnd.randint(0, ENV))
+                sen = sen[:len(sen) - overlap] + window
+        if sen:
+            sentences.append(sen)
+    return fields, sentences
+
+
+def cases(inputs, shuffles, randoms, templates, seed):
+    """:return: the list of cases, see make_document()"""
+    result = [('input', path, None) for path in inputs]
+    result += [('template', None, seed + i) for i in range(templates)]
+    result += [('shuffled', path, seed + i) for path in inputs
+               for i in range(shuffles)]
+    result += [('random', None, seed + i) for i in range(randoms)]
+    return result
+
+
+def make_document(case):
+    kind, path, seed = case
+    if kind == 'input':
+        return read_document(path)
+    if kind == 'shuffled':
+        return shuffled_document(path, seed)
+    if kind == 'template':
+        return template_document(seed)
+    return random_document(seed)
+
+
+def field_names(fields):
+    """Return the field_names of prepare_fields() for the input *fields*."""
+    return make_field_names(list(fields) + TARGET_FIELDS)
+
+
+def run(engine, fields, sentences, mode='sentence', window=None):
+    """
+    Process a copy of the document with a new instance of *engine*.
+    :return: the processed sentences, and the exception that stopped the
+             processing (or None)
+    """
+    em_preverb = engine(source_fields=set(SOURCE_FIELDS),
+                        target_fields=list(TARGET_FIELDS))
+    sentences = [[list(tok) for tok in sen] for sen in sentences]
+    processed = []
+    try:
+        field_values = em_preverb.prepare_fields(field_names(fields))
+        if mode == 'sentence':
+            for sen in sentences:
+                processed.append(em_preverb.process_sentence(sen,
+                                                             field_values))
+        elif mode == 'sentences':
+            for sen in em_preverb.process_sentences(sentences, field_values):
+                processed.append(sen)
+        else:
+            for sen in sentences:
+                processed.append(list(em_preverb.process_tokens(
+                    iter(sen), field_values, window=window or 1)))
+    except Exception as e:
+        return normalised(processed), e
+    return normalised(processed), None
+
+
+def normalised(sentences):
+    """Return the processed *sentences* as lists of lists (the baseline
+    returns the tokens as dict views)."""
+    return [[list(tok) for tok in sen] for sen in sentences]
+
+
+def first_difference(expected, got):
+    """
+    Compare two results of run().
+    :return: the index of the first differing sentence, or None
+    """
+    (expected, expected_error), (got, got_error) = expected, got
+    for i, (expected_sen, got_sen) in enumerate(zip(expected, got)):
+        if expected_sen != got_sen:
+            return i
+    if len(expected) != len(got) or repr(expected_error) != repr(got_error):
+        return min(len(expected), len(got))
+    return None
+
+
+def ddmin(items, test):
+    """
+    Remove parts of *items* (a list) while test(items) holds
+    (delta debugging). :return: the reduced list
+    """
+    parts = 2
+    while len(items) >= 2:
+        size = -(-len(items) // parts)
+        for start in range(0, len(items), size):
+            rest = items[:start] + items[start + size:]
+            if rest and test(rest):
+                items = rest
+                parts = max(parts - 1, 2)
+                break
+        else:
+            if parts >= len(items):
+                break
+            parts = min(parts * 2, len(items))
+    return items
+
+
+def without_rule(tree, name):
+    """Return the decision tree *tree* without the Rule *name*."""
+    result = []
+    for node in tree:
+        if isinstance(node, Case):
+            result.append(node._replace(rules=without_rule(node.rules,
+                                                           name)))
+        elif node.name != name:
+            result.append(node)
+    return tuple(result)
+
+
+class Checker:
+    """Compare the candidate engine to the reference on documents."""
+
+    def __init__(self, engine, mode, window, removed_rule=None):
+        """:param removed_rule: remove this rule from the candidate"""
+        self.reference = BaselineEmPreverb
+        self.engine = load_engine(engine)
+        if removed_rule is not None:
+            self.engine = type(self.engine.__name__, (self.engine,), {
+                'rules': without_rule(self.engine.rules, removed_rule)})
+        self.mode = mode
+        self.window = window
+
+    def difference(self, fields, sentences):
+        """:return: the index of the first differing sentence, or None"""
+        return first_difference(
+            run(self.reference, fields, sentences),
+            run(self.engine, fields, sentences, self.mode, self.window))
+
+    def minimise(self, fields, sentences):
+        """Return the smallest document found on which the engines differ."""
+        def differs(document):
+            return self.difference(fields, document) is not None
+
+        # the sentences after the first difference do not matter
+        sentences = sentences[:self.difference(fields, sentences) + 1]
+        sentences = ddmin(sentences, differs)
+        for i in range(len(sentences)):
+            sentences[i] = ddmin(sentences[i], lambda sen: differs(
+                sentences[:i] + [sen] + sentences[i + 1:]))
+        return sentences
+
+    def report(self, fields, sentences):
+        """Return the description of the first difference of the engines."""
+        expected = run(self.reference, fields, sentences)
+        got = run(self.engine, fields, sentences, self.mode, self.window)
+        index = first_difference(expected, got)
+        lines = ['first difference in sentence {0} of the minimised '
+                 'document:'.format(index + 1)]
+        header = '\t'.join(list(fields) + TARGET_FIELDS)
+        for name, (processed, error) in (('baseline', expected),
+                                         ('candidate', got)):
+            lines.append('--- {0}'.format(name))
+            if index < len(processed):
+                lines.append(header)
+                lines.extend('\t'.join(tok) for tok in processed[index])
+            if error is not None:
+                lines.append('error: {0!r}'.format(error))
+        return '\n'.join(lines) + '\n'
+
+
+_checker = None # the Checker of the worker process
+
+
+def _init_worker(engine, mode, window, removed_rule=None):
+    global _checker
+    _checker = Checker(engine, mode, window, removed_rule)
+
+
+def _differs(case):
+    fields, sentences = make_document(case)
+    return _checker.difference(fields, sentences) is not None
+
+
+def _check_case(case):
+    """
+    :return: the case, the number of sentences and tokens, and None or
+             the minimised document and the report of the difference
+    """
+    fields, sentences = make_document(case)
+    size = len(sentences), sum(map(len, sentences))
+    if _checker.difference(fields, sentences) is None:
+        return case, size, None
+    sentences = _checker.minimise(fields, sentences)
+    return case, size, (fields, sentences,
+                        _checker.report(fields, sentences))
+
+
+def coverage(documents):
+    """
+    Return the rules of the decision tree and the branches of clean_up()
+    that the reference engine does not take on *documents*.
+    """
+    names = rule_names(EmPreverb.rules)
+    taken = set()
+    em_preverb = EmPreverb(source_fields=set(SOURCE_FIELDS),
+                           target_fields=list(TARGET_FIELDS), stats=True)
+    for fields, sentences in documents:
+        layout = em_preverb.prepare_fields(field_names(fields))
+        prev = len(fields)
+        for sen in sentences:
+            processed = em_preverb.process_sentence([list(tok) for tok in sen],
+                                                    layout)
+            if any(tok[prev] == 'conn' for tok in processed):
+                taken.add('clean_up: conn, compound' if 'compound' in fields
+                          else 'clean_up: conn')
+    taken.update(name for name in names if em_preverb.stats.hits[name])
+    if em_preverb.stats.orphans:
+        taken.add('clean_up: orphaned sep')
+    return [name for name in names + ['clean_up: conn',
+                                      'clean_up: conn, compound',
+                                      'clean_up: orphaned sep']
+            if name not in taken]
+
+
+def self_test(opts):
+    """
+    Check that the template documents take all rules and branches and
+    that the candidate differs from the reference without any one rule.
+    :return: the number of failures
+    """
+    template_cases = cases([], 0, 0, opts.templates, opts.seed)
+    failures = coverage(map(make_document, template_cases))
+    for name in failures:
+        print('{0}: not taken on the template documents'.format(name))
+    for name in rule_names(load_engine(opts.engine).rules):
+        with Pool(opts.jobs, _init_worker,
+                  (opts.engine, opts.mode, opts.window, name)) as pool:
+            detected = any(pool.imap(_differs, template_cases))
+        print('without {0}: {1}'.format(
+            name, 'difference found' if detected else 'NO DIFFERENCE'))
+        if not detected:
+            failures.append(name)
+    return len(failures)
+
+
+def format_document(fields, sentences):
+    """Return the emtsv text of the document."""
+    return '\t'.join(fields) + '\n' + ''.join(
+        '\n'.join('\t'.join(tok) for tok in sen) + '\n\n' for sen in sentences)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--engine', default='vectorised',
+                        help='The candidate engine: {0} or module:Class '
+                             '(default: vectorised)'.format(
+                                 ', '.join(ENGINES)))
+    parser.add_argument('--mode', choices=MODES, default='sentences',
+                        help='Run the candidate with process_sentence, '
+                             'process_sentences or process_tokens '
+                             '(default: sentences)')
+    parser.add_argument('--window', type=int, default=8,
+                        help='Window of process_tokens (default: 8)')
+    parser.add_argument('--inputs', nargs='*',
+                        default=sorted(glob(os.path.join(ROOT, 'tests',
+                                                         'inputs', '*.in'))),
+                        help='Input files (default: tests/inputs/*.in)')
+    parser.add_argument('--shuffles', type=int, default=5,
+                        help='Shuffled versions of each input (default: 5)')
+    parser.add_argument('--random', type=int, default=500,
+                        help='Number of random documents (default: 500)')
+    parser.add_argument('--templates', type=int, default=200,
+                        help='Number of template documents (default: 200)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the first shuffled, random and '
+                             'template document')
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+                        help='Number of worker processes (default: all '
+                             'cores)')
+    parser.add_argument('-o', '--reproducer', default=None,
+                        help='Save the minimised reproducer to this file',
+                        metavar='FILE')
+    parser.add_argument('--self-test', action='store_true',
+                        help='Check that the template documents take all '
+                             'rules, and that a candidate without any one '
+                             'of them differs from the reference')
+    opts = parser.parse_args()
+    load_engine(opts.engine) # fail early
+
+    if opts.self_test:
+        sys.exit(1 if self_test(opts) else 0)
+
+    all_cases = cases(opts.inputs, opts.shuffles, opts.random,
+                      opts.templates, opts.seed)
+    sentences = tokens = 0
+    with Pool(opts.jobs, _init_worker,
+              (opts.engine, opts.mode, opts.window)) as pool:
+        for case, size, difference in pool.imap(_check_case, all_cases):
+            sentences += size[0]
+            tokens += size[1]
+            if difference is not None:
+                pool.terminate()
+                break
+    if difference is None:
+        print('{0} documents, {1} sentences, {2} tokens: no difference'
+              .format(len(all_cases), sentences, tokens))
+        return
+    fields, minimised, report = difference
+    kind, path, seed = case
+    print('Difference in the {0} document{1}{2}'.format(
+        kind, ' ' + os.path.relpath(path) if path else '',
+        ' (seed {0})'.format(seed) if seed is not None else ''))
+    print(report)
+    reproducer = format_document(fields, minimised)
+    if opts.reproducer is not None:
+        with open(opts.reproducer, 'w', encoding='utf-8') as fh:
+            fh.write(reproducer)
+        print('Minimised reproducer saved to {0}'.format(opts.reproducer))
+    else:
+        print('Minimised reproducer:')
+        print(reproducer, end='')
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()